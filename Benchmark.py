@@ -0,0 +1,229 @@
+import Schulze
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+
+def impartial_culture(candidates, ballots, rng):
+    """
+Every ranking equally likely
+    :param candidates: list of candidate names
+    :param ballots: number of rankings to generate
+    :param rng: random.Random instance
+    :return: list of rankings, most preferred first
+    """
+    return [rng.sample(candidates, len(candidates)) for b in range(ballots)]
+
+
+def mallows(candidates, ballots, rng, phi=0.5):
+    """
+Rankings scattered around the candidate list's own order (Mallows model, repeated insertion)
+    :param candidates: list of candidate names; their order is the reference ranking
+    :param ballots: number of rankings to generate
+    :param rng: random.Random instance
+    :param phi: dispersion, 0 < phi <= 1. Small values keep rankings close to the reference.
+    :return: list of rankings, most preferred first
+    """
+    rankings = []
+    for b in range(ballots):
+        ranking = []
+        for i, c in enumerate(candidates):
+            # insert at position j with probability proportional to phi ** (i - j)
+            weights = [phi ** (i - j) for j in range(i + 1)]
+            ranking.insert(rng.choices(range(i + 1), weights)[0], c)
+        rankings.append(ranking)
+    return rankings
+
+
+def single_peaked(candidates, ballots, rng):
+    """
+Rankings single-peaked on the axis given by the candidate list's order
+    :param candidates: list of candidate names in axis order
+    :param ballots: number of rankings to generate
+    :param rng: random.Random instance
+    :return: list of rankings, most preferred first
+    """
+    rankings = []
+    for b in range(ballots):
+        left = right = rng.randrange(len(candidates))
+        ranking = [candidates[left]]
+        while len(ranking) < len(candidates):
+            # move outwards from the peak, one side at a time
+            if right == len(candidates) - 1 or (left > 0 and rng.random() < 0.5):
+                left -= 1
+                ranking.append(candidates[left])
+            else:
+                right += 1
+                ranking.append(candidates[right])
+        rankings.append(ranking)
+    return rankings
+
+
+def condorcet_cycles(candidates, ballots, rng):
+    """
+Rotations of a single ranking, which produce one large Condorcet cycle
+    :param candidates: list of candidate names
+    :param ballots: number of rankings to generate
+    :param rng: random.Random instance
+    :return: list of rankings, most preferred first
+    """
+    rankings = []
+    for b in range(ballots):
+        r = rng.randrange(len(candidates))
+        rankings.append(candidates[r:] + candidates[:r])
+    return rankings
+
+
+GENERATORS = {'impartial': impartial_culture,
+              'mallows': mallows,
+              'single_peaked': single_peaked,
+              'cycles': condorcet_cycles}
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def _sum(ballots):
+    total = ballots[0]
+    for b in ballots[1:]:
+        total = total + b
+    return total
+
+
+def _phases(rankings, kernel):
+    """Run every benchmarked phase once, yielding (phase name, seconds)"""
+    ballots, seconds = _timed(lambda: [Schulze.Ballot(r) for r in rankings])
+    yield 'ballot_init', seconds
+    total, seconds = _timed(_sum, ballots)
+    del ballots
+    yield 'ballot_add', seconds
+    g, seconds = _timed(Schulze.Graph, total, False, kernel)
+    yield 'graph_init', seconds
+    result, seconds = _timed(g._calcPaths)
+    yield 'calc_paths', seconds
+    result, seconds = _timed(g._calcRankings)
+    yield 'calc_rankings', seconds
+
+
+def run_case(model, candidates, ballots, seed, kernel='auto', memory=True):
+    """
+Benchmark one synthetic election
+    :param model: key of GENERATORS
+    :param candidates: number of candidates
+    :param ballots: number of ballots
+    :param seed: random seed; the same seed always produces the same election
+    :param kernel: strongest path kernel passed to Schulze.Graph
+    :param memory: also measure the peak memory of every phase (in a second, traced run)
+    :return: dict of the case parameters, seconds per phase and peak bytes per phase
+    """
+    rng = random.Random('{}-{}-{}-{}'.format(seed, model, candidates, ballots))
+    names = ['c{}'.format(i) for i in range(candidates)]
+    rankings = GENERATORS[model](names, ballots, rng)
+    gc.collect()
+    result = {'model': model, 'candidates': candidates, 'ballots': ballots, 'seed': seed, 'kernel': kernel,
+              'seconds': dict(_phases(rankings, kernel)), 'peak_bytes': {}}
+    if memory:
+        phases = _phases(rankings, kernel)
+        tracemalloc.start()
+        try:
+            while True:
+                tracemalloc.reset_peak()
+                try:
+                    name, seconds = next(phases)
+                except StopIteration:
+                    break
+                result['peak_bytes'][name] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def environment():
+    """
+Describe the machine and source revision the benchmark ran on
+    :return: dict suitable for JSON output
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': Schulze._numpy() is not None,
+            'commit': commit}
+
+
+def run_grid(models, candidates, ballots, seed=0, kernel='auto', memory=True, log=None):
+    """
+Benchmark every combination of model, candidate count and ballot count
+    :return: dict with the environment and a list of case results
+    """
+    results = []
+    for model in models:
+        for c in candidates:
+            for b in ballots:
+                results.append(run_case(model, c, b, seed, kernel, memory))
+                if log:
+                    log(results[-1])
+    return {'environment': environment(), 'results': results}
+
+
+def compare(old, new):
+    """
+Print the time ratio new/old of every phase present in both benchmark reports
+    """
+    def key(r):
+        return r['model'], r['candidates'], r['ballots'], r['kernel']
+
+    baseline = {key(r): r for r in old['results']}
+    for r in new['results']:
+        if key(r) not in baseline:
+            continue
+        ratios = ['{}={:.2f}x'.format(phase, seconds / baseline[key(r)]['seconds'][phase])
+                  for phase, seconds in r['seconds'].items()
+                  if baseline[key(r)]['seconds'].get(phase)]
+        print('{}\t{}c\t{}b\t{}'.format(r['model'], r['candidates'], r['ballots'], '\t'.join(ratios)))
+    return
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Schulze.Ballot and Schulze.Graph on synthetic elections')
+    parser.add_argument('--models', nargs='+', default=sorted(GENERATORS), choices=sorted(GENERATORS))
+    parser.add_argument('--candidates', nargs='+', type=int, default=[5, 20, 50])
+    parser.add_argument('--ballots', nargs='+', type=int, default=[100, 1000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--kernel', default='auto', choices=Schulze.Graph.kernels)
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='skip peak memory measurement')
+    parser.add_argument('--out', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    def log(r):
+        print('{model}\t{candidates}c\t{ballots}b\t'.format(**r) +
+              '\t'.join('{}={:.4f}s'.format(k, v) for k, v in r['seconds'].items()), file=sys.stderr)
+
+    report = run_grid(args.models, args.candidates, args.ballots, args.seed, args.kernel, args.memory, log)
+    if args.out:
+        with open(args.out, mode='w') as fout:
+            json.dump(report, fout, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+    if args.compare:
+        with open(args.compare, mode='r') as fin:
+            compare(json.load(fin), report)
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,17 @@
 import Schulze
+import csv
+import json
+import mmap
 import os
-import random
+import re
+import struct
+import sys
+from array import array
+from collections import Counter
+
+LOG_MAGIC = b'SCHZLOG2'
+LOG_MAGIC_V1 = b'SCHZLOG1'  # full strict rankings only, no tie or end markers
+LOG_HEADER = struct.Struct('<8scxxxII')  # magic, record typecode, candidate count, name block length
 
 
 def poll_file(poll_name: str) -> str:
@@ -23,6 +34,24 @@ Given a filename containing poll metadata, return the poll ID
     return poll_name
 
 
+def ballot_log(poll_name: str) -> str:
+    """
+Take a poll ID string and convert it to the matching binary ballot log filename
+    :param poll_name: test
+    :return: ballot log file name like  'XXXXXXX.ballots.bin'
+    """
+    return poll_name + '.ballots.bin'
+
+
+def snapshot_file(poll_name: str) -> str:
+    """
+Take a poll ID string and convert it to the matching tally snapshot filename
+    :param poll_name: test
+    :return: snapshot file name like  'XXXXXXX.tally.snapshot'
+    """
+    return poll_name + '.tally.snapshot'
+
+
 def new_poll(output_dir='.'):
     name = input('What is the name of your new poll?\n')
     num = int(input('How many choices will there be? '))
@@ -49,6 +78,107 @@ def load_poll(poll_name, voting_dir='.'):
     return options
 
 
+class CandidateRegistry(object):
+    """
+Candidates of one poll, casefolded and interned once and numbered in choices file order
+    Every line read from a ballot file (any case, surrounding whitespace, trailing newline) is
+    remembered, so translating it again is a single dict lookup. Names from anywhere else, such as
+    network requests, are resolved without being stored, so untrusted input cannot grow the registry.
+    """
+
+    def __init__(self, candidates):
+        """
+    :param candidates: candidate names in poll order
+    """
+        self.names = [sys.intern(c.strip().casefold()) for c in candidates]
+        self._canonical = {c: i for i, c in enumerate(self.names)}
+        if len(self._canonical) != len(self.names):
+            raise ValueError('Duplicate candidates in poll')
+        self._ids = dict(self._canonical)  # any spelling seen -> ID
+
+    @classmethod
+    def from_poll(cls, poll_name, vote_dir='.\\votes'):
+        """Build the registry of a poll from its choices file"""
+        return cls(load_poll(poll_name, vote_dir))
+
+    def __len__(self):
+        return len(self.names)
+
+    def id(self, name):
+        """
+Return the ID of a candidate
+    :param name: candidate name in any case, with or without surrounding whitespace
+    :return: index of the candidate in the poll
+    """
+        try:
+            return self._ids[name]
+        except KeyError:
+            pass
+        try:
+            return self._canonical[name.strip().casefold()]
+        except KeyError:
+            raise ValueError('Unknown candidate {!r}'.format(name.strip())) from None
+
+    def groups(self, ranking):
+        """
+Translate a ranking into tied groups of candidate IDs
+    :param ranking: candidates most preferred first. An entry may be a list of tied candidates.
+    :return: list of lists of IDs, most preferred first
+    """
+        groups = []
+        for entry in ranking:
+            if isinstance(entry, str):
+                groups.append([self.id(entry)])
+            else:
+                group = sorted(self.id(c) for c in entry)
+                if group:
+                    groups.append(group)
+        return self._checked(groups)
+
+    def read(self, ballot_file):
+        """
+Read a ballot file (see read_ranking) straight into tied groups of candidate IDs
+    :param ballot_file: path of the ballot file
+    :return: list of lists of IDs, most preferred first
+    """
+        ids = self._ids
+        groups = []
+        with open(ballot_file, mode='r') as fin:
+            for line in fin:
+                i = ids.get(line)
+                if i is not None:
+                    groups.append([i])
+                elif '=' in line:
+                    groups.append(sorted(self.id(c) for c in line.split('=')))
+                elif line.strip():
+                    i = ids[line] = self.id(line)  # remember this spelling for the next ballot file
+                    groups.append([i])
+        return self._checked(groups)
+
+    @staticmethod
+    def _checked(groups):
+        if len({i for group in groups for i in group}) != sum(len(group) for group in groups):
+            raise ValueError('Duplicate candidates on ballot')
+        return groups
+
+    def blank(self, sparse=False):
+        """Return an empty tally whose candidate indices are this registry's IDs"""
+        return (Schulze.SparseBallot if sparse else Schulze.Ballot)._blank(self.names)
+
+    def add(self, total, groups, weight=1):
+        """
+Add a ranking of candidate IDs to a tally made by blank()
+    :param total: Schulze.Ballot to add to
+    :param groups: tied groups of candidate IDs, as returned by groups() or read()
+    :param weight: number of voters casting this ranking
+    """
+        if len(groups) == len(self.names) and all(len(group) == 1 for group in groups):
+            total._addOrder([group[0] for group in groups], weight)  # full ranking without ties
+        else:
+            total._addGroups(groups, weight)
+        return
+
+
 def admin_console(voting_dir='.\\votes'):
     # Initialize directory structure if needed
     if not os.path.exists(voting_dir):
@@ -92,6 +222,7 @@ def get_polls(vote_dir):
 
 def voting_console(poll_name, vote_dir='.\\votes'):
     valid = False
+    import random
     choices = load_poll(poll_name, vote_dir)
     ID = hex(random.randrange(65536))[2:]  # generate a random ID number for this ballot
     ID = ID.upper()
@@ -115,39 +246,900 @@ def voting_console(poll_name, vote_dir='.\\votes'):
             valid = True
         else:
             rank.clear()
-    file_name = '.'.join([poll_name, ID, 'ballot.txt'])
-    with open(os.path.join(vote_dir, file_name), mode='w') as fout:
-        for choice in rank:
-            fout.write(choice)
-            fout.write('\n')
+    append_ballot(poll_name, rank, vote_dir)
     return rank
 
 
-def tally_votes(poll_name, vote_dir='.\\votes'):
-    vote_files = []
+def create_ballot_log(poll_name, vote_dir='.\\votes'):
+    """
+Start an empty binary ballot log for a poll
+    The header records the candidate list from <poll>.choices.txt. Every ballot
+    appended afterwards is one fixed-size record of candidate indices, most
+    preferred first. The top bit of an entry marks a candidate tied with the one
+    before it, and a truncated ballot is padded with all-ones end markers.
+    :param poll_name: poll ID
+    :param vote_dir: directory holding the poll
+    :return: path of the ballot log
+    """
+    choices = load_poll(poll_name, vote_dir)
+    names = '\n'.join(choices).encode('utf-8')
+    names += bytes(-(LOG_HEADER.size + len(names)) % 8)  # keep records 8-byte aligned
+    typecode = b'H' if len(choices) <= 0x7FFF else b'I'
+    log_file = os.path.join(vote_dir, ballot_log(poll_name))
+    with open(log_file, mode='xb') as fout:
+        fout.write(LOG_HEADER.pack(LOG_MAGIC, typecode, len(choices), len(names)))
+        fout.write(names)
+    return log_file
+
+
+def read_log_header(log_file):
+    """
+Read the header of a binary ballot log
+    :param log_file: path of the ballot log
+    :return: (candidates, record typecode, offset of the first record, whether records carry tie/end markers)
+    """
+    with open(log_file, mode='rb') as fin:
+        magic, typecode, n, size = LOG_HEADER.unpack(fin.read(LOG_HEADER.size))
+        if magic not in (LOG_MAGIC, LOG_MAGIC_V1):
+            raise ValueError('{} is not a ballot log'.format(log_file))
+        names = fin.read(size).rstrip(b'\x00').decode('utf-8')
+    candidates = names.split('\n') if n else []
+    if len(candidates) != n:
+        raise ValueError('{} has a corrupt header'.format(log_file))
+    return candidates, typecode.decode('ascii'), LOG_HEADER.size + size, magic == LOG_MAGIC
+
+
+def append_ballot(poll_name, ranking, vote_dir='.\\votes'):
+    """
+Append one ranked ballot to the poll's binary ballot log, creating the log if needed
+    :param poll_name: poll ID
+    :param ranking: candidates most preferred first. An entry may be a list of tied candidates,
+        and candidates left off are tied last.
+    :param vote_dir: directory holding the poll
+    """
+    log_file = os.path.join(vote_dir, ballot_log(poll_name))
+    if not os.path.exists(log_file):
+        create_ballot_log(poll_name, vote_dir)
+    candidates, typecode, offset, markers = read_log_header(log_file)
+    data = encode_ballot(ranking, CandidateRegistry(candidates), typecode, markers).tobytes()
+    with open(log_file, mode='ab') as fout:
+        partial = (fout.tell() - offset) % len(data)
+        if partial:
+            # drop a record left half written by an interrupted append
+            fout.truncate(fout.tell() - partial)
+        fout.write(data)
+    return
+
+
+def encode_ballot(ranking, registry, typecode, markers=True):
+    """
+Validate a ranking and encode it as one ballot log record
+    :param ranking: candidates most preferred first. An entry may be a list of tied candidates,
+        and candidates left off are tied last.
+    :param registry: CandidateRegistry of the candidates in the log header
+    :param typecode: record typecode from read_log_header
+    :param markers: whether the log accepts tie and end markers
+    :return: array of record entries
+    """
+    tie = _tie_marker(typecode)
+    entries = []
+    for group in registry.groups(ranking):
+        entries.append(group[0])
+        entries.extend(i | tie for i in group[1:])
+    if not markers and (len(entries) != len(registry) or max(entries, default=0) >= tie):
+        raise ValueError('This ballot log only holds full rankings without ties. Migrate it first.')
+    return array(typecode, entries + [2 * tie - 1] * (len(registry) - len(entries)))
+
+
+def _tie_marker(typecode):
+    return 1 << (8 * array(typecode).itemsize - 1)
+
+
+def record_groups(record, typecode):
+    """
+Decode a ballot log record into tied groups of candidate indices, most preferred first
+    :param record: sequence of record entries
+    :param typecode: record typecode from read_log_header
+    :return: list of lists of candidate indices; unranked candidates are left out
+    """
+    tie = _tie_marker(typecode)
+    groups = []
+    for entry in record:
+        if entry < tie:
+            groups.append([entry])
+        elif entry == 2 * tie - 1:
+            break  # end marker, the rest of the ballot is unranked
+        else:
+            groups[-1].append(entry & (tie - 1))
+    return groups
+
+
+def _add_record(total, record, typecode, n, weight=1):
+    """Add one ballot log record over n candidates to a Schulze.Ballot"""
+    if max(record, default=0) < n:
+        total._addOrder(record, weight)  # full ranking without ties
+    else:
+        total._addGroups(record_groups(record, typecode), weight)
+    return
+
+
+def iter_log_records(log_file, start=None, stop=None):
+    """
+Yield every ballot stored in a binary ballot log as a zero-copy view of candidate indices
+    The log is memory mapped; each record is only valid until the next one is requested.
+    A truncated record at the end of the log (interrupted append) is ignored.
+    :param log_file: path of the ballot log
+    :param start: byte offset of the first record to read. Defaults to the first record in the log.
+    :param stop: byte offset to stop reading at. Defaults to the end of the log.
+    """
+    candidates, typecode, offset, markers = read_log_header(log_file)
+    if start is not None:
+        offset = start
+    n = len(candidates)
+    width = n * array(typecode).itemsize
+    with open(log_file, mode='rb') as fin:
+        if not width or os.fstat(fin.fileno()).st_size - offset < width:
+            return
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                count = ((len(mm) if stop is None else min(stop, len(mm))) - offset) // width
+                for r in range(count):
+                    start = offset + r * width
+                    with view[start:start + width].cast(typecode) as record:
+                        yield record
+            finally:
+                view.release()
+
+
+def migrate_poll(poll_name, vote_dir='.\\votes'):
+    """
+Move a poll's legacy .ballot.txt files into its binary ballot log
+    Every file is read and validated first, then all of their ballots are appended in one synced write
+    and only then are the text files deleted. If any file is invalid nothing is migrated.
+    A log written before ties were supported is upgraded in place.
+    :param poll_name: poll ID
+    :param vote_dir: directory holding the poll
+    :return: number of ballots migrated
+    """
+    ballot_files = list(iter_ballot_files(poll_name, vote_dir))
+    log_file = os.path.join(vote_dir, ballot_log(poll_name))
+    if ballot_files:
+        # the snapshot counts these ballots as text files, and would count them again as log records
+        invalidate_snapshot(poll_name, vote_dir)
+    if ballot_files and not os.path.exists(log_file):
+        create_ballot_log(poll_name, vote_dir)
+    if os.path.exists(log_file):
+        candidates, typecode, offset, markers = read_log_header(log_file)
+        if not markers and len(candidates) < _tie_marker(typecode):
+            # Older log of full rankings. Its records are valid as they are; only the header changes.
+            with open(log_file, mode='r+b') as fout:
+                fout.write(LOG_MAGIC)
+    if ballot_files:
+        # encode every ballot before writing any, so a bad file leaves the log untouched
+        candidates, typecode, offset, markers = read_log_header(log_file)
+        registry = CandidateRegistry(candidates)
+        data = b''.join(encode_ballot(read_ranking(ballot_file), registry, typecode, markers).tobytes()
+                        for ballot_file in ballot_files)
+        with open(log_file, mode='ab') as fout:
+            width = len(candidates) * array(typecode).itemsize
+            end = fout.tell() - ((fout.tell() - offset) % width if width else 0)  # drop a record left half written
+            fout.truncate(end)
+            try:
+                fout.write(data)
+                fout.flush()
+                os.fsync(fout.fileno())
+            except OSError:
+                fout.truncate(end)
+                raise
+    # the files are deleted only once all of their ballots are safely in the log
+    for ballot_file in ballot_files:
+        os.remove(ballot_file)
+    return len(ballot_files)
+
+
+def migrate_votes(vote_dir='.\\votes'):
+    """
+Migrate every poll in a votes directory to binary ballot logs
+    :param vote_dir: directory holding the polls
+    :return: dict of poll ID -> number of ballots migrated
+    """
+    return {poll: migrate_poll(poll, vote_dir) for poll in get_polls(vote_dir)}
+
+
+def iter_ballot_files(poll_name, vote_dir='.\\votes'):
+    """
+Yield the path of every ballot file cast in a poll
+    :param poll_name: poll ID
+    :param vote_dir: directory holding the poll
+    """
     for entry in os.scandir(vote_dir):
         # find .ballot.txt
         if entry.is_file() and entry.name.startswith(poll_name) and entry.name.endswith('.ballot.txt'):
-            vote_files.append(os.path.join(vote_dir, entry.name))
-    ballots = [read_ballot(b) for b in vote_files]
-    total = ballots[0]  # initialize total
-    for b in ballots[1:]:
-        total += b
+            yield os.path.join(vote_dir, entry.name)
+
+
+def iter_rankings(poll_name, vote_dir='.\\votes'):
+    """
+Stream the rankings cast in a poll, one ballot file at a time
+    :param poll_name: poll ID
+    :param vote_dir: directory holding the poll
+    :return: generator of candidate lists, most preferred first
+    """
+    for ballot_file in iter_ballot_files(poll_name, vote_dir):
+        yield read_ranking(ballot_file)
+
+
+def tally_votes(poll_name, vote_dir='.\\votes', distinct=False, incremental=False, rebuild=False, sparse=False):
+    """
+Tally a poll into a single pairwise matrix
+    Ballots are read from the poll's binary ballot log and from any legacy
+    .ballot.txt files. Each ranking is added straight into one Schulze.Ballot,
+    so memory stays proportional to candidates squared however many ballots there are.
+    :param poll_name: poll ID
+    :param vote_dir: directory holding the poll
+    :param distinct: count identical rankings first and expand each distinct ranking only once.
+        Much faster when many voters agree, but holds every distinct ranking in memory.
+    :param incremental: resume from the poll's tally snapshot, read only ballots cast since, and save a new snapshot.
+        The snapshot is rebuilt automatically when the choices file changes.
+    :param rebuild: ignore any existing snapshot and re-read every ballot
+    :param sparse: tally into a Schulze.SparseBallot, which stores only pairs ranked on the same ballot.
+        For polls with very many candidates where each voter ranks only a few.
+    :return: Schulze.Ballot holding the pairwise totals
+    """
+    kind = Schulze.SparseBallot if sparse else Schulze.Ballot
+    total, log_offset, tallied = kind(), None, ()
+    if incremental and not rebuild:
+        snapshot = load_snapshot(poll_name, vote_dir)
+        if snapshot is not None and isinstance(snapshot[0], Schulze.SparseBallot) == sparse:
+            total, log_offset, tallied = snapshot
+
+    log_file = os.path.join(vote_dir, ballot_log(poll_name))
+    if os.path.exists(log_file):
+        candidates, typecode, offset, markers = read_log_header(log_file)
+        width = len(candidates) * array(typecode).itemsize
+        if log_offset is None or log_offset > os.path.getsize(log_file):
+            # no usable watermark. Start over from the first record and re-read every ballot file.
+            total, log_offset, tallied = kind._blank(c.casefold() for c in candidates), offset, ()
+            if width:
+                total.reserve((os.path.getsize(log_file) - offset) // width)  # one vote per record at most
+        read = 0
+        if distinct:
+            counts = Counter()
+            for record in iter_log_records(log_file, log_offset):
+                counts[record.tobytes()] += 1
+                read += 1
+            for record, weight in counts.items():
+                _add_record(total, array(typecode, record), typecode, len(candidates), weight)
+        else:
+            for record in iter_log_records(log_file, log_offset):
+                _add_record(total, record, typecode, len(candidates))
+                read += 1
+        log_offset += read * width
+
+    if not total.candidates() and os.path.exists(os.path.join(vote_dir, poll_file(poll_name))):
+        # ballots may leave candidates out, so take the candidate list from the poll itself
+        total = kind._blank(c.casefold() for c in load_poll(poll_name, vote_dir))
+    # ballot files are tracked by name, since neither their names nor their mtimes arrive in order
+    tallied, text_files = set(tallied), []
+    registry = CandidateRegistry(total.candidates()) if total.candidates() else None
+    counts = Counter()
+    for ballot_file in iter_ballot_files(poll_name, vote_dir):
+        name = os.path.basename(ballot_file)
+        text_files.append(name)
+        if name in tallied:
+            continue
+        if registry is None:
+            # no candidate list anywhere; the first ballot supplies it
+            total.addRanking(read_ranking(ballot_file))
+        elif distinct:
+            counts[tuple(map(tuple, registry.read(ballot_file)))] += 1
+        else:
+            registry.add(total, registry.read(ballot_file))
+    for groups, weight in counts.items():
+        registry.add(total, groups, weight)
+
+    if incremental:
+        save_snapshot(poll_name, total, log_offset, text_files, vote_dir)
     return total
 
 
-def read_ballot(ballot_file):
-    ID = ballot_file.split('.')[-3]
+def poll_candidates(poll_name, vote_dir='.\\votes'):
+    """
+Candidate list of a poll, as tallies of it are laid out
+    :param poll_name: poll ID
+    :param vote_dir: directory holding the poll
+    :return: candidates from the ballot log header, else from the choices file, else an empty list
+    """
+    log_file = os.path.join(vote_dir, ballot_log(poll_name))
+    if os.path.exists(log_file):
+        return read_log_header(log_file)[0]
+    if os.path.exists(os.path.join(vote_dir, poll_file(poll_name))):
+        return load_poll(poll_name, vote_dir)
+    return []
+
+
+def plan_shards(poll_name, vote_dir='.\\votes', shards=4):
+    """
+Split a poll's ballots into shards that can be tallied independently
+    The binary ballot log is cut into contiguous record ranges of nearly equal size and
+    legacy ballot files are dealt out round robin.
+    :param poll_name: poll ID
+    :param vote_dir: directory holding the poll
+    :param shards: number of shards
+    :return: list of shards, dicts with 'log' ([start, stop] byte offsets into the log, or None) and 'files'
+    """
+    if shards < 1:
+        raise ValueError('shards must be at least 1')
+    plan = [{'log': None, 'files': []} for s in range(shards)]
+    log_file = os.path.join(vote_dir, ballot_log(poll_name))
+    if os.path.exists(log_file):
+        candidates, typecode, offset, markers = read_log_header(log_file)
+        width = len(candidates) * array(typecode).itemsize
+        count = (os.path.getsize(log_file) - offset) // width if width else 0
+        for s, shard in enumerate(plan):
+            shard['log'] = [offset + count * s // shards * width, offset + count * (s + 1) // shards * width]
+    for i, ballot_file in enumerate(sorted(iter_ballot_files(poll_name, vote_dir))):
+        plan[i % shards]['files'].append(ballot_file)
+    return plan
+
+
+def tally_shard(poll_name, shard, vote_dir='.\\votes', partial=None, sparse=False):
+    """
+Tally one shard of a poll into a partial pairwise matrix
+    :param poll_name: poll ID
+    :param shard: one entry of plan_shards()
+    :param vote_dir: directory holding the poll
+    :param partial: also write the partial tally to this file, see write_partial()
+    :param sparse: tally into a Schulze.SparseBallot
+    :return: (Schulze.Ballot, number of ballots tallied)
+    """
+    kind = Schulze.SparseBallot if sparse else Schulze.Ballot
+    total = kind._blank(c.casefold() for c in poll_candidates(poll_name, vote_dir))
+    ballots = 0
+    if shard.get('log'):
+        log_file = os.path.join(vote_dir, ballot_log(poll_name))
+        candidates, typecode, offset, markers = read_log_header(log_file)
+        for record in iter_log_records(log_file, *shard['log']):
+            _add_record(total, record, typecode, len(candidates))
+            ballots += 1
+    registry = CandidateRegistry(total.candidates())
+    for ballot_file in shard.get('files', ()):
+        if len(registry):
+            registry.add(total, registry.read(ballot_file))
+        else:
+            total.addRanking(read_ranking(ballot_file))
+        ballots += 1
+    if partial is not None:
+        write_partial(partial, total, {'poll': poll_name, 'choices': _choices_digest(poll_name, vote_dir),
+                                       'ballots': ballots})
+    return total, ballots
+
+
+def write_partial(partial, total, meta):
+    """
+Write a partial tally that can be merged with others, on this host or another
+    The file is one JSON line of metadata followed by Schulze.Ballot.dump() output.
+    :param partial: file to write
+    :param total: Schulze.Ballot holding the partial pairwise totals
+    :param meta: dict with at least 'poll', 'choices' (digest of the choices file) and 'ballots'
+    """
+    with open(partial + '.tmp', mode='wb') as fout:
+        fout.write(json.dumps(meta).encode('utf-8'))
+        fout.write(b'\n')
+        total.dump(fout)
+    os.replace(partial + '.tmp', partial)
+    return
+
+
+def read_partial(partial):
+    """
+Read a partial tally written by write_partial()
+    :param partial: file to read
+    :return: (Schulze.Ballot, metadata dict)
+    """
+    with open(partial, mode='rb') as fin:
+        meta = json.loads(fin.readline().decode('utf-8'))
+        total = Schulze.Ballot.load(fin)
+    return total, meta
+
+
+def _merge_group(partials, out_file):
+    """Sum a group of partial tallies into one partial file. Runs in a worker process."""
+    total, meta = read_partial(partials[0])
+    for partial in partials[1:]:
+        other, other_meta = read_partial(partial)
+        if (other_meta['poll'], other_meta['choices']) != (meta['poll'], meta['choices']):
+            raise ValueError('{} and {} are tallies of different polls'.format(partials[0], partial))
+        total = total + other
+        meta['ballots'] += other_meta['ballots']
+    write_partial(out_file, total, meta)
+    return
+
+
+def merge_partials(partials, out_file=None, fan_in=2, workers=1):
+    """
+Combine partial tallies with a tree reduction
+    Partials are summed fan_in at a time, level by level, so every merge holds at most
+    fan_in matrices and the merges of one level run side by side on a pool of processes.
+    :param partials: partial tally files, see write_partial()
+    :param out_file: also write the combined tally here as a partial
+    :param fan_in: number of partials summed per merge
+    :param workers: number of processes
+    :return: (Schulze.Ballot, metadata dict) of the combined tally
+    """
+    if not partials:
+        raise ValueError('No partial tallies to merge')
+    if fan_in < 2:
+        raise ValueError('fan_in must be at least 2')
+    import shutil
+    import tempfile
+    work_dir = tempfile.mkdtemp(prefix='schulze-merge-')
+    pool = None
+    try:
+        if workers > 1 and len(partials) > fan_in:
+            import multiprocessing
+            pool = multiprocessing.Pool(workers)
+        level = list(partials)
+        depth = 0
+        while len(level) > 1:
+            groups = [level[i:i + fan_in] for i in range(0, len(level), fan_in)]
+            merged = [os.path.join(work_dir, '{}.{}.partial'.format(depth, g)) for g in range(len(groups))]
+            if pool is not None:
+                pool.starmap(_merge_group, zip(groups, merged))
+            else:
+                for group, out in zip(groups, merged):
+                    _merge_group(group, out)
+            level = merged
+            depth += 1
+        if out_file is not None:
+            shutil.copyfile(level[0], out_file)
+        return read_partial(level[0])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def map_reduce_tally(poll_name, vote_dir='.\\votes', workers=None, shards=None, partial_dir=None,
+                     sparse=False, fan_in=2):
+    """
+Tally a poll on several processes: each shard into its own partial, then a tree reduction
+    Gives the same totals as tally_votes().
+    :param poll_name: poll ID
+    :param vote_dir: directory holding the poll
+    :param workers: number of processes. Defaults to the number of CPUs.
+    :param shards: number of shards. Defaults to the number of workers.
+    :param partial_dir: keep the shard partials in this directory, e.g. to send them to another site.
+        By default they are written to a temporary directory and deleted.
+    :param sparse: tally into a Schulze.SparseBallot
+    :param fan_in: number of partials summed per merge
+    :return: Schulze.Ballot holding the pairwise totals
+    """
+    import multiprocessing
+    import shutil
+    import tempfile
+    workers = workers or os.cpu_count() or 1
+    plan = plan_shards(poll_name, vote_dir, shards or workers)
+    out_dir = partial_dir if partial_dir is not None else tempfile.mkdtemp(prefix='schulze-shards-')
+    try:
+        os.makedirs(out_dir, exist_ok=True)
+        files = [os.path.join(out_dir, '{}.shard{}.partial'.format(poll_name, s)) for s in range(len(plan))]
+        args = [(poll_name, shard, vote_dir, out, sparse) for shard, out in zip(plan, files)]
+        if workers > 1:
+            with multiprocessing.Pool(workers) as pool:
+                pool.starmap(_tally_shard_file, args)
+        else:
+            for a in args:
+                _tally_shard_file(*a)
+        total, meta = merge_partials(files, None, fan_in, workers)
+    finally:
+        if partial_dir is None:
+            shutil.rmtree(out_dir, ignore_errors=True)
+    return total
+
+
+def _tally_shard_file(poll_name, shard, vote_dir, partial, sparse):
+    """Tally a shard into its partial file. Runs in a worker process and returns nothing to pickle back."""
+    tally_shard(poll_name, shard, vote_dir, partial, sparse)
+    return
+
+
+def _choices_digest(poll_name, vote_dir):
+    choices = os.path.join(vote_dir, poll_file(poll_name))
+    if not os.path.exists(choices):
+        return None
+    with open(choices, mode='rb') as fin:
+        import hashlib
+        return hashlib.sha256(fin.read()).hexdigest()
+
+
+def save_snapshot(poll_name, total, log_offset, text_files, vote_dir='.\\votes'):
+    """
+Persist a running tally together with the watermark of the last ballots it includes
+    :param poll_name: poll ID
+    :param total: Schulze.Ballot holding the pairwise totals
+    :param log_offset: byte offset in the ballot log just past the last record tallied
+    :param text_files: names of the legacy ballot files tallied
+    :param vote_dir: directory holding the poll
+    """
+    meta = {'choices': _choices_digest(poll_name, vote_dir), 'log_offset': log_offset,
+            'text_files': sorted(text_files)}
+    out_file = os.path.join(vote_dir, snapshot_file(poll_name))
+    with open(out_file + '.tmp', mode='wb') as fout:
+        fout.write(json.dumps(meta).encode('utf-8'))
+        fout.write(b'\n')
+        total.dump(fout)
+    os.replace(out_file + '.tmp', out_file)
+    return
+
+
+def load_snapshot(poll_name, vote_dir='.\\votes'):
+    """
+Load a poll's tally snapshot
+    :param poll_name: poll ID
+    :param vote_dir: directory holding the poll
+    :return: (Schulze.Ballot, log offset, names of the ballot files tallied), or None if there is no
+        snapshot, the choices file has changed since it was taken or it predates file name tracking
+    """
+    in_file = os.path.join(vote_dir, snapshot_file(poll_name))
+    if not os.path.exists(in_file):
+        return None
+    with open(in_file, mode='rb') as fin:
+        meta = json.loads(fin.readline().decode('utf-8'))
+        if meta['choices'] != _choices_digest(poll_name, vote_dir) or 'text_files' not in meta:
+            return None
+        total = Schulze.Ballot.load(fin)
+    return total, meta['log_offset'], meta['text_files']
+
+
+def invalidate_snapshot(poll_name, vote_dir='.\\votes'):
+    """
+Delete a poll's tally snapshot so that the next incremental tally starts from scratch
+    :param poll_name: poll ID
+    :param vote_dir: directory holding the poll
+    """
+    try:
+        os.remove(os.path.join(vote_dir, snapshot_file(poll_name)))
+    except FileNotFoundError:
+        pass
+    return
+
+
+def read_ranking(ballot_file):
+    """
+Read a ballot file: one candidate per line, most preferred first
+    Candidates tied with each other share a line, separated by '='.
+    :param ballot_file: path of the ballot file
+    :return: list of candidates and lists of tied candidates
+    """
     vote = []
     with open(ballot_file, mode='r') as fin:
         for line in fin:
-            vote.append(line.strip())
-    return Schulze.Ballot(vote, ID)
+            if '=' in line:
+                vote.append([c.strip() for c in line.split('=')])
+            elif line.strip():
+                vote.append(line.strip())
+    return vote
+
+
+def read_ballot(ballot_file, registry=None):
+    """
+Read a ballot file into a Schulze.Ballot
+    :param ballot_file: path of the ballot file
+    :param registry: CandidateRegistry of the poll. The ballot then holds every candidate of the poll,
+        and unknown names raise ValueError.
+    :return: Schulze.Ballot tagged with the ballot's ID
+    """
+    ID = ballot_file.split('.')[-3]
+    if registry is None:
+        return Schulze.Ballot(read_ranking(ballot_file), ID)
+    ballot = registry.blank()
+    ballot.ID = ID
+    registry.add(ballot, registry.read(ballot_file))
+    return ballot
 
 
-def main():
-    pass
+def _number(text):
+    """Parse a weight or rank: an integer, or else an exact fraction such as '0.25' or '1/3'"""
+    try:
+        return int(text)
+    except ValueError:
+        from fractions import Fraction
+        return Fraction(text.strip())
+
+
+def _add_counts(total, counts):
+    """Add a Counter of rankings (tuples of tied groups of candidate IDs) to a tally and empty it"""
+    total._addBatch((groups, weight) for groups, weight in counts.items() if weight)
+    counts.clear()
+    return
+
+
+def import_csv(csv_file, registry=None, layout='ranked', weight_column=None, header=False, total=None,
+               sparse=False, chunk_size=65536):
+    """
+Stream a CSV file of ballots into a pairwise tally in one pass
+    Rows are read in chunks. Identical rankings within a chunk are added to the tally once, so memory
+    is bounded by the chunk size however large the file is.
+    :param csv_file: path of the CSV file
+    :param registry: CandidateRegistry of the candidates. Required for the 'ranked' layout;
+        by default the 'grid' layout builds one from its header row.
+    :param layout: 'ranked' -- each row lists candidates, most preferred first. A cell may hold tied
+        candidates separated by '=', and empty cells are skipped.
+        'grid' -- a header row names one candidate per column and each cell holds the rank given to
+        that candidate: lower is preferred, equal ranks tie and an empty cell leaves it unranked.
+    :param weight_column: index of a column holding each row's weight (number of voters), if any
+    :param header: skip the first row ('grid' always has a header row)
+    :param total: tally to add to, made by registry.blank(). A new one is made by default.
+    :param sparse: make the new tally a Schulze.SparseBallot
+    :param chunk_size: number of distinct rankings collected before they are added to the tally
+    :return: Schulze.Ballot holding the pairwise totals
+    """
+    if layout not in ('ranked', 'grid'):
+        raise ValueError('Unknown CSV layout: {}'.format(layout))
+    with open(csv_file, mode='r', newline='', encoding='utf-8-sig') as fin:
+        rows = csv.reader(fin)
+        first = next(rows, []) if header or layout == 'grid' else None
+        if layout == 'grid':
+            columns = [i for i in range(len(first)) if i != weight_column]
+            if registry is None:
+                registry = CandidateRegistry(first[i] for i in columns)
+            ids = [registry.id(first[i]) for i in columns]
+        elif registry is None:
+            raise ValueError("The 'ranked' CSV layout needs a CandidateRegistry")
+        if total is None:
+            total = registry.blank(sparse)
+        known = registry._ids
+        counts = Counter()
+        try:
+            for row in rows:
+                weight = 1
+                if weight_column is not None:
+                    weight = _number(row[weight_column])
+                if layout == 'grid':
+                    ranks = sorted((_number(row[i]), c) for i, c in zip(columns, ids) if row[i].strip())
+                    groups = []
+                    for r, (rank, c) in enumerate(ranks):
+                        if r and rank == ranks[r - 1][0]:
+                            groups[-1].append(c)
+                        else:
+                            groups.append([c])
+                    ranking = tuple(map(tuple, registry._checked(groups)))
+                else:
+                    if weight_column is not None:
+                        row = row[:weight_column] + row[weight_column + 1:]
+                    try:
+                        # fast path: every cell a known spelling of one candidate
+                        ids = [known[cell] for cell in row if cell]
+                    except KeyError:
+                        ranking = tuple(map(tuple, registry.groups(cell.split('=') if '=' in cell else cell
+                                                                   for cell in row if cell.strip())))
+                    else:
+                        if len(set(ids)) != len(ids):
+                            raise ValueError('Duplicate candidates on ballot')
+                        ranking = tuple(zip(ids))
+                counts[ranking] += weight
+                if len(counts) >= chunk_size:
+                    _add_counts(total, counts)
+        except (ValueError, IndexError) as e:
+            raise ValueError('{} line {}: {}'.format(csv_file, rows.line_num, e)) from None
+        _add_counts(total, counts)
+    return total
+
+
+def import_blt(blt_file, sparse=False, chunk_size=65536):
+    """
+Stream a BLT file (the preferential ballot format used by OpenSTV and others) into a pairwise tally
+    Each ballot line is a weight, then candidate numbers (from 1) most preferred first, then 0.
+    Candidates tied with each other are joined by '='. Withdrawn candidates (negative numbers on the
+    line after the header) are removed from the tally.
+    :param blt_file: path of the BLT file
+    :param sparse: tally into a Schulze.SparseBallot
+    :param chunk_size: number of distinct rankings collected before they are added to the tally
+    :return: (Schulze.Ballot holding the pairwise totals, election title)
+    """
+    with open(blt_file, mode='r', encoding='utf-8-sig') as fin:
+        lines = (line.split() for line in fin)
+        line = next((tokens for tokens in lines if tokens), None)
+        if line is None:
+            raise ValueError('{} is empty'.format(blt_file))
+        n = int(line[0])
+        registry = CandidateRegistry(str(c + 1) for c in range(n))  # names follow the ballots
+        total = registry.blank(sparse)
+        withdrawn = []
+        counts = Counter()
+        for tokens in lines:
+            if not tokens:
+                continue
+            if tokens[0].startswith('-'):
+                withdrawn.extend(-int(t) for t in tokens)
+                continue
+            if tokens[0].startswith('('):
+                tokens = tokens[1:]  # ballot ID
+            if tokens == ['0']:
+                break
+            try:
+                ranking = [t.split('=') if '=' in t else t for t in tokens[1:] if t not in ('0', '-')]
+                counts[tuple(map(tuple, registry.groups(ranking)))] += _number(tokens[0])
+            except ValueError as e:
+                raise ValueError('{}: {} in ballot {}'.format(blt_file, e, ' '.join(tokens))) from None
+            if len(counts) >= chunk_size:
+                _add_counts(total, counts)
+        _add_counts(total, counts)
+        strings = [re.sub(r'\\(.)', r'\1', s) for s in re.findall(r'"((?:[^"\\]|\\.)*)"', fin.read())]
+    if len(strings) < n:
+        raise ValueError('{} names {} of {} candidates'.format(blt_file, len(strings), n))
+    names = strings[:n]
+    total._rename(names)
+    total._drop([total.candidates()[c - 1] for c in dict.fromkeys(withdrawn)])
+    return total, strings[n] if len(strings) > n else None
+
+
+def _export_format(out_file, fmt):
+    fmt = fmt or ('json' if out_file.lower().endswith('.json') else 'csv')
+    if fmt not in ('csv', 'json'):
+        raise ValueError('Unknown export format: {}'.format(fmt))
+    return fmt
+
+
+def _open_output(out_file):
+    """Open an export file for writing, or standard output for '-'"""
+    if out_file == '-':
+        return open(sys.stdout.fileno(), mode='w', newline='', closefd=False)
+    return open(out_file, mode='w', newline='')
+
+
+def export_matrix(candidates, rows, out_file, fmt=None):
+    """
+Write a candidate by candidate matrix in bulk
+    CSV has the candidates in the header row and first column; JSON is {"candidates": [...], "matrix": [[...], ...]}.
+    Fractional counts are written as strings such as '1/3'.
+    :param candidates: candidate names, in row and column order
+    :param rows: matrix rows in candidate order
+    :param out_file: file to write, or '-' for standard output
+    :param fmt: 'csv' or 'json'. By default taken from the file extension.
+    """
+    if _export_format(out_file, fmt) == 'json':
+        with _open_output(out_file) as fout:
+            json.dump({'candidates': list(candidates), 'matrix': [list(row) for row in rows]}, fout, default=str)
+    else:
+        with _open_output(out_file) as fout:
+            writer = csv.writer(fout)
+            writer.writerow([''] + list(candidates))
+            writer.writerows([c] + list(row) for c, row in zip(candidates, rows))
+    return
+
+
+def export_pairwise(total, out_file, fmt=None):
+    """
+Write the pairwise matrix of a tally: row candidate's votes over column candidate
+    :param total: Schulze.Ballot
+    :param out_file: file to write, or '-' for standard output
+    :param fmt: 'csv' or 'json'. By default taken from the file extension.
+    """
+    candidates = total.candidates()
+    if isinstance(total, Schulze.SparseBallot):
+        rows = ([total.get(a, b) for b in candidates] for a in candidates)
+    else:
+        n = len(candidates)
+        rows = (total._tally[i * n:(i + 1) * n] for i in range(n))
+    export_matrix(candidates, rows, out_file, fmt)
+    return
+
+
+def export_paths(graph, out_file, fmt=None):
+    """
+Write the strongest path matrix of a Schulze.Graph over every candidate
+    :param graph: Schulze.Graph
+    :param out_file: file to write, or '-' for standard output
+    :param fmt: 'csv' or 'json'. By default taken from the file extension.
+    """
+    candidates = graph._tally.candidates()
+    paths = graph._fullPaths()
+    n = len(candidates)
+    export_matrix(candidates, (paths[i * n:(i + 1) * n] for i in range(n)), out_file, fmt)
+    return
+
+
+def export_ladder(ladder, out_file, fmt=None):
+    """
+Write a ladder, most preferred first
+    CSV rows are place,candidate, where tied candidates share a place; JSON is {"ladder": [...]} with ties as lists.
+    :param ladder: result of Schulze.Graph.ladder()
+    :param out_file: file to write, or '-' for standard output
+    :param fmt: 'csv' or 'json'. By default taken from the file extension.
+    """
+    groups = [[entry] if isinstance(entry, str) else list(entry) for entry in ladder]
+    if _export_format(out_file, fmt) == 'json':
+        with _open_output(out_file) as fout:
+            json.dump({'ladder': [group[0] if len(group) == 1 else group for group in groups]}, fout)
+    else:
+        with _open_output(out_file) as fout:
+            writer = csv.writer(fout)
+            writer.writerow(['place', 'candidate'])
+            place = 1
+            for group in groups:
+                writer.writerows([place, c] for c in group)
+                place += len(group)
+    return
+
+
+def _cli_poll(args):
+    if not any(os.path.exists(os.path.join(args.votes, f)) for f in (poll_file(args.poll), ballot_log(args.poll))):
+        raise ValueError('Unknown poll {} in {}'.format(args.poll, args.votes))
+    return args.poll
+
+
+def _cli_tally(args):
+    # a read-only votes directory cannot hold the snapshot, so tally from scratch there
+    incremental = not args.no_snapshot and os.access(args.votes, os.W_OK)
+    return tally_votes(_cli_poll(args), args.votes, incremental=incremental, rebuild=args.rebuild, sparse=args.sparse)
+
+
+def main(argv=None):
+    """
+Non-interactive entry point for scripts and cron jobs: tally, rank or export one poll, or migrate polls
+    Tallies resume from the poll's snapshot (see tally_votes), so repeated runs only read new ballots.
+    The snapshot is skipped with --no-snapshot or when the votes directory is not writable.
+    :param argv: command line arguments, sys.argv[1:] by default
+    :return: exit status
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog='Console.py', description='Tally and rank a Schulze poll')
+    parser.add_argument('--votes', default=os.path.join('.', 'votes'), help='directory holding the polls')
+    commands = parser.add_subparsers(dest='command', required=True)
+    tally = commands.add_parser('tally', help='bring the tally up to date and write its pairwise matrix')
+    rank = commands.add_parser('rank', help='print the Schulze ladder, most preferred first')
+    export = commands.add_parser('export', help='write the pairwise matrix, strongest paths or ladder')
+    migrate = commands.add_parser('migrate', help='move legacy .ballot.txt files into binary ballot logs')
+    for command in (tally, rank, export):
+        command.add_argument('poll', help='poll ID')
+        command.add_argument('--sparse', action='store_true', help='tally into a Schulze.SparseBallot')
+        command.add_argument('--rebuild', action='store_true', help='ignore the snapshot and re-read every ballot')
+        command.add_argument('--no-snapshot', action='store_true', help='neither read nor write the tally snapshot')
+    migrate.add_argument('poll', nargs='?', help='poll ID, every poll in the votes directory by default')
+    for command in (rank, export):
+        command.add_argument('--kernel', default='auto', choices=Schulze.Graph.kernels, help='strongest path kernel')
+    export.add_argument('what', choices=('pairwise', 'paths', 'ladder'))
+    for command in (tally, export):
+        command.add_argument('--out', default='-', help="file to write, '-' for standard output")
+        command.add_argument('--format', choices=('csv', 'json'), help='default from the --out extension, else csv')
+    rank.add_argument('--json', action='store_true', help='print the ladder as JSON, ties as lists')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'migrate':
+            if args.poll is None:
+                migrated = migrate_votes(args.votes)
+            else:
+                migrated = {args.poll: migrate_poll(_cli_poll(args), args.votes)}
+            for poll, count in sorted(migrated.items()):
+                print('{}\t{}'.format(poll, count))
+            return 0
+        total = _cli_tally(args)
+        if args.command == 'tally' or args.command == 'export' and args.what == 'pairwise':
+            export_pairwise(total, args.out, args.format)
+            return 0
+        if args.command == 'export' and args.what == 'paths' and args.sparse:
+            total = total.dense()  # path queries need the full matrix
+        graph = Schulze.Graph(total, verbose=False, kernel=args.kernel)
+        if args.command == 'rank':
+            if args.json:
+                export_ladder(graph.ladder(), '-', 'json')
+                print()
+            else:
+                graph.print_ladder()
+        elif args.what == 'paths':
+            export_paths(graph, args.out, args.format)
+        else:
+            export_ladder(graph.ladder(), args.out, args.format)
+    except (OSError, ValueError, KeyError) as e:
+        print('{}: error: {}'.format(parser.prog, e), file=sys.stderr)
+        return 1
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Self-tests of Console.py. Run with: python ConsoleTest.py"""
+import json
+import os
+import shutil
+import tempfile
+import Console
+from Schulze import Ballot
+
+
+def _poll(vote_dir, poll_name, choices):
+    with open(os.path.join(vote_dir, Console.poll_file(poll_name)), mode='w') as fout:
+        fout.write('\n'.join(choices) + '\n')
+    return
+
+
+def _ballot_file(vote_dir, poll_name, ID, ranking, mtime_ns=None):
+    ballot_file = os.path.join(vote_dir, '{}.{}.ballot.txt'.format(poll_name, ID))
+    with open(ballot_file, mode='w') as fout:
+        for entry in ranking:
+            fout.write((entry if isinstance(entry, str) else '='.join(entry)) + '\n')
+    if mtime_ns is not None:
+        os.utime(ballot_file, ns=(mtime_ns, mtime_ns))
+    return ballot_file
+
+
+def main():
+    vote_dir = tempfile.mkdtemp(prefix='schulze-console-')
+    try:
+        # ballot log round trip, with ties and truncated rankings
+        _poll(vote_dir, 'p', ['Alice', 'Bob', 'Carol'])
+        Console.append_ballot('p', ['alice', 'bob', 'carol'], vote_dir)
+        Console.append_ballot('p', [['Carol', 'bob']], vote_dir)
+        Console.append_ballot('p', ['bob'], vote_dir)
+        candidates, typecode, offset, markers = Console.read_log_header(os.path.join(vote_dir, 'p.ballots.bin'))
+        records = [Console.record_groups(r, typecode)
+                   for r in Console.iter_log_records(os.path.join(vote_dir, 'p.ballots.bin'))]
+        if candidates != ['Alice', 'Bob', 'Carol'] or records != [[[0], [1], [2]], [[1, 2]], [[1]]]:
+            raise NotImplementedError('Ballot log round trip failed')
+        expected = Ballot._blank(['alice', 'bob', 'carol'])
+        for ranking in (['alice', 'bob', 'carol'], [['carol', 'bob']], ['bob']):
+            expected.addRanking(ranking)
+        if Console.tally_votes('p', vote_dir) != expected or \
+                Console.tally_votes('p', vote_dir, distinct=True, sparse=True) != expected:
+            raise NotImplementedError('Ballot log tally failed')
+
+        # incremental tallies read only new ballots and always agree with a full tally
+        _ballot_file(vote_dir, 'p', 'BEEF', ['Bob', 'Alice'], 10 ** 18)
+        for ID, ranking in (('CAFE', ['carol']), ('0001', ['Alice', 'Carol'])):
+            if Console.tally_votes('p', vote_dir, incremental=True) != Console.tally_votes('p', vote_dir):
+                raise NotImplementedError('Incremental tally failed')
+            _ballot_file(vote_dir, 'p', ID, ranking, 10 ** 18)  # same mtime as a ballot already tallied
+            Console.append_ballot('p', ranking, vote_dir)
+        full = Console.tally_votes('p', vote_dir)
+        if Console.tally_votes('p', vote_dir, incremental=True) != full or full.get('bob', 'alice') != 3:
+            raise NotImplementedError('Incremental tally missed ballot files')
+
+        # sharded tallies: partials round trip and merge to the same totals as a single tally
+        partial = os.path.join(vote_dir, 'p.partial')
+        shard, ballots = Console.tally_shard('p', Console.plan_shards('p', vote_dir, 3)[1], vote_dir, partial)
+        if Console.read_partial(partial) != (shard, {'poll': 'p', 'choices': Console._choices_digest('p', vote_dir),
+                                                      'ballots': ballots}) or not ballots:
+            raise NotImplementedError('Partial tally round trip failed')
+        os.remove(partial)
+        if Console.map_reduce_tally('p', vote_dir, workers=2, shards=3) != full or \
+                Console.map_reduce_tally('p', vote_dir, workers=1, sparse=True) != full:
+            raise NotImplementedError('Sharded tally failed')
+
+        # migration moves ballot files into the log without counting them twice
+        if Console.migrate_poll('p', vote_dir) != 3 or list(Console.iter_ballot_files('p', vote_dir)):
+            raise NotImplementedError('Migration failed')
+        if Console.tally_votes('p', vote_dir, incremental=True) != full or Console.tally_votes('p', vote_dir) != full:
+            raise NotImplementedError('Tally after migration failed')
+        Console.invalidate_snapshot('p', vote_dir)
+        if Console.load_snapshot('p', vote_dir) is not None:
+            raise NotImplementedError('Snapshot invalidation failed')
+        del candidates, typecode, offset, markers, records, expected, full, partial, shard, ballots
+
+        # CSV and BLT imports: ties, weights, grid layout, withdrawn candidates and escaped titles
+        registry = Console.CandidateRegistry(['Alice', 'Bob', 'Carol'])
+        spellings = len(registry._ids)
+        if registry.groups([' ALICE', ['bob ', 'Carol']]) != [[0], [1, 2]] or len(registry._ids) != spellings:
+            raise NotImplementedError('Candidate registry stored an untrusted spelling')
+        expected = registry.blank()
+        for groups, weight in (([[0], [1, 2]], 3), ([[2], [0]], 2), ([[1]], 1)):
+            registry.add(expected, groups, weight)
+        import_file = os.path.join(vote_dir, 'import.csv')
+        with open(import_file, mode='w') as fout:
+            fout.write('3,Alice,Bob=carol\n2,Carol,alice,\n1,bob\n')
+        if Console.import_csv(import_file, registry, weight_column=0) != expected:
+            raise NotImplementedError('Ranked CSV import failed')
+        with open(import_file, mode='w') as fout:
+            fout.write('Alice,weight,Bob,Carol\n1,3,2,2\n2,2,,1\n,1,1,\n')
+        if Console.import_csv(import_file, layout='grid', weight_column=1) != expected:
+            raise NotImplementedError('Grid CSV import failed')
+        with open(import_file, mode='w') as fout:
+            fout.write('4 1\n-4\n3 1 2=3 0\n2 3 4 1 0\n1 2 0\n(x) 1/2 4 0\n0\n'
+                       '"Alice" "Bob" "Carol" "Dave" "The \\"2024\\" poll"\n')
+        total, title = Console.import_blt(import_file)
+        if total != expected or title != 'The "2024" poll':
+            raise NotImplementedError('BLT import failed')
+        os.remove(import_file)
+        del registry, spellings, expected, groups, weight, import_file, total, title
+
+        # command line: rank without touching the votes directory, then migrate
+        import contextlib
+        import io
+        _poll(vote_dir, 'q', ['Alice', 'Bob'])
+        _ballot_file(vote_dir, 'q', '0002', ['bob'])
+        before = sorted(os.listdir(vote_dir))
+        out_file = vote_dir + '.ladder.json'
+        status = Console.main(['--votes', vote_dir, 'export', 'q', 'ladder', '--out', out_file, '--no-snapshot'])
+        with open(out_file, mode='r') as fin:
+            ladder = json.load(fin)
+        os.remove(out_file)
+        if status or ladder != {'ladder': ['bob', 'alice']} or sorted(os.listdir(vote_dir)) != before:
+            raise NotImplementedError('Command line export failed')
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            status = Console.main(['--votes', vote_dir, 'migrate'])
+        if status or out.getvalue() != 'p\t0\nq\t1\n' or list(Console.iter_ballot_files('q', vote_dir)):
+            raise NotImplementedError('Command line migrate failed')
+        del before, out_file, ladder, out, status
+
+        # a migration that meets an invalid ballot file moves nothing
+        _poll(vote_dir, 'r', ['a', 'b'])
+        _ballot_file(vote_dir, 'r', '0003', ['a', 'b'])
+        bad = _ballot_file(vote_dir, 'r', '0004', ['z'])
+        try:
+            Console.migrate_poll('r', vote_dir)
+        except ValueError:
+            pass
+        else:
+            raise NotImplementedError('Migration accepted an invalid ballot')
+        if not os.path.exists(bad) or len(list(Console.iter_ballot_files('r', vote_dir))) != 2 or \
+                list(Console.iter_log_records(os.path.join(vote_dir, Console.ballot_log('r')))):
+            raise NotImplementedError('Failed migration left ballots in the log')
+        _ballot_file(vote_dir, 'r', '0004', ['b'])
+        if Console.migrate_poll('r', vote_dir) != 2 or Console.tally_votes('r', vote_dir).get('a', 'b') != 1:
+            raise NotImplementedError('Migration after a failure failed')
+        del bad
+    finally:
+        shutil.rmtree(vote_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
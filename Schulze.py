@@ -1,64 +1,520 @@
-# TODO:  allow voting for ties
-# TODO:  multithreading for large candidate sets
-# TODO:  weight and change weight
+import bisect
+import json
+import operator
+import os
+import sys
+import time
+from array import array
+from collections import Counter, OrderedDict
 
-import datetime
+
+_TYPECODES = 'bhiq'  # signed 8, 16, 32 and 64-bit counts, narrowest first
+
+
+def _typecode(lo, hi):
+    """Internal function. Return the narrowest of _TYPECODES holding every count from lo to hi, or None."""
+    for typecode in _TYPECODES:
+        limit = 1 << (8 * array(typecode).itemsize - 1)
+        if -limit <= lo and hi < limit:
+            return typecode
+    return None
+
+
+def _pack(values, bound=0):
+    """Internal function. Store pairwise counts in the most compact container that holds them exactly.
+
+Counts are kept in the narrowest signed array ('b', 'h', 'i' or 'q') holding both them and any count
+from -bound to bound. Anything that does not fit (fractions, huge integers) falls back to a plain
+list so that no value is ever truncated.
+"""
+    values = list(values)
+    typecode = _typecode(min(min(values, default=0), -bound), max(max(values, default=0), bound))
+    if typecode is not None:
+        try:
+            return array(typecode, values)
+        except TypeError:
+            pass  # fractions
+    return values
+
+
+def _dumpCounts(counts):
+    """Internal function. Encode a JSON structure of counts as bytes.
+
+Exact fractions, which JSON has no type for, are written as 'n/d' strings.
+Return the bytes and whether any fraction was written, which the reader must be told.
+"""
+    fractions = []
+
+    def exact(value):
+        if hasattr(value, 'numerator') and hasattr(value, 'denominator'):
+            fractions.append(value)
+            return '{}/{}'.format(value.numerator, value.denominator)
+        raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+    data = json.dumps(counts, default=exact).encode('utf-8')
+    return data, bool(fractions)
+
+
+def _loadCounts(data, fractions=False):
+    """Internal function. Decode counts written by _dumpCounts(), turning 'n/d' strings back into Fractions."""
+    counts = json.loads(data.decode('utf-8'))
+    if fractions:
+        from fractions import Fraction
+
+        def exact(value):
+            if isinstance(value, str):
+                return Fraction(value)
+            if isinstance(value, list):
+                return [exact(v) for v in value]
+            if isinstance(value, dict):
+                return {k: exact(v) for k, v in value.items()}
+            return value
+
+        counts = exact(counts)
+    return counts
+
+
+_np = None
+
+
+def _numpy():
+    """Internal function. Import NumPy on first use. Return None if it is not installed."""
+    global _np
+    if _np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        _np = numpy
+    return _np
+
+
+def _asNumpy(values, n):
+    """Internal function. Return a flat row-major sequence as an n x n NumPy array.
+
+Compact arrays are wrapped without copying; exact Python values become an object array.
+"""
+    np = _np
+    if isinstance(values, array):
+        return np.frombuffer(values, dtype=values.typecode).reshape(n, n)
+    return np.array(values, dtype=object).reshape(n, n)
+
+
+def _relaxPython(p, n, i, lo=0, hi=None):
+    """Internal function. Reference Floyd–Warshall step: relax every path in p through pivot i.
+
+p is a flat row-major n x n sequence of path strengths and is updated in place.
+Only rows lo..hi are written, so disjoint row bands can be relaxed concurrently.
+"""
+    row = p[i * n:(i + 1) * n]  # row i is unchanged by its own pivot
+    for j in range(lo, n if hi is None else hi):
+        if i != j:
+            base = j * n
+            through = p[base + i]
+            for k in range(n):
+                if i != k and j != k:
+                    p[base + k] = max(p[base + k], min(through, row[k]))
+    return
+
+
+def _relaxNumpy(p, i, lo=0, hi=None):
+    """Internal function. Vectorized Floyd–Warshall step: relax rows lo..hi of the n x n array p through pivot i."""
+    np = _np
+    band = p[lo:hi]
+    np.maximum(band, np.minimum.outer(band[:, i], p[i, :]), out=band)
+    return
+
+
+def _relaxStacked(p):
+    """Internal function. Floyd–Warshall over a stack of path matrices: p is a B x k x k array, relaxed in place.
+
+Every pivot relaxes the whole stack in one vectorized step, so many small matrices cost about as
+much interpreter time as one.
+"""
+    np = _np
+    through = np.empty_like(p)
+    for i in range(p.shape[1]):
+        np.minimum(p[:, :, i, None], p[:, None, i, :], out=through)
+        np.maximum(p, through, out=p)
+    return
+
+
+def _stackedLevels(beats):
+    """Internal function. Level the candidates of a stack of Schulze relations (a B x k x k boolean array).
+
+A candidate is levelled 0 if it beats nobody, else one above the highest candidate it beats. The
+relation is transitive, so a candidate has more wins than anyone it beats and one pass in order of
+wins levels every candidate after all those below it, for the whole stack at once.
+"""
+    np = _np
+    count, k = beats.shape[:2]
+    order = np.argsort(beats.sum(2), axis=1, kind='stable')
+    level = np.zeros((count, k), dtype=np.int64)
+    rows = np.arange(count)
+    for t in range(k):
+        a = order[:, t]
+        level[rows, a] = np.where(beats[rows, a], level, -1).max(1) + 1
+    return level
+
+
+def _batchLadders(ballots, kernel):
+    """Internal function. Worker process body of Graph.ladders()."""
+    return Graph.ladders(ballots, kernel)
+
+
+def _batchSubsets(ballot, keeps, kernel):
+    """Internal function. Worker process body of Graph.subsetLadders(), for subsets given as candidate positions."""
+    return Graph.ladders((ballot._subset(keep) for keep in keeps), kernel)
+
+
+def _pathWorker(shmName, n, lo, hi, barrier, useNumpy):
+    """Internal function. Worker process body: relax rows lo..hi of a shared path matrix, one pivot at a time.
+
+Every pivot ends on the barrier, so no worker starts pivot i + 1 before all rows are done with pivot i.
+"""
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shmName)
+    p = None
+    try:
+        if useNumpy:
+            np = _numpy()
+            p = np.ndarray((n, n), dtype=np.int64, buffer=shm.buf)
+            for i in range(n):
+                _relaxNumpy(p, i, lo, hi)
+                barrier.wait()
+        else:
+            p = shm.buf.cast('q')
+            for i in range(n):
+                _relaxPython(p, n, i, lo, hi)
+                barrier.wait()
+    except BaseException:
+        barrier.abort()
+        raise
+    finally:
+        if isinstance(p, memoryview):
+            p.release()
+        p = None
+        shm.close()
+    return
+
+
+class _PathPool(object):
+    """Internal class. Worker processes sharing one 64-bit path matrix, each owning a band of rows."""
+
+    def __init__(self, paths, n, workers, useNumpy):
+        import multiprocessing
+        from multiprocessing import shared_memory
+        self._n = n
+        self._useNumpy = useNumpy
+        if useNumpy:
+            data = paths.astype(_np.int64).tobytes()
+        else:
+            data = array('q', paths).tobytes()
+        self._shm = shared_memory.SharedMemory(create=True, size=max(len(data), 8))
+        self._shm.buf[:len(data)] = data
+        self._barrier = multiprocessing.Barrier(workers + 1)  # workers plus the coordinating process
+        bounds = [n * w // workers for w in range(workers + 1)]
+        self._processes = [multiprocessing.Process(target=_pathWorker, daemon=True,
+                                                   args=(self._shm.name, n, bounds[w], bounds[w + 1],
+                                                         self._barrier, useNumpy))
+                           for w in range(workers)]
+        for proc in self._processes:
+            proc.start()
+
+    def step(self, i):
+        """Wait until every worker has relaxed its rows through pivot i"""
+        import threading
+        try:
+            self._barrier.wait()
+        except threading.BrokenBarrierError:
+            raise RuntimeError('Strongest path worker failed at pivot {}'.format(i)) from None
+        return
+
+    def result(self):
+        """Return the finished path matrix in the same form the serial kernel uses"""
+        for proc in self._processes:
+            proc.join()
+        data = bytes(self._shm.buf[:8 * self._n * self._n])
+        if self._useNumpy:
+            return _np.frombuffer(data, dtype=_np.int64).reshape(self._n, self._n).copy()
+        return array('q', data)
+
+    def close(self):
+        for proc in self._processes:
+            if proc.is_alive():
+                proc.terminate()
+        self._shm.close()
+        self._shm.unlink()
+        return
+
+
+def _rankingGroups(ranking):
+    """Internal function. Normalize a ranking to a tuple of tied groups of casefolded names, most preferred first.
+
+Each entry of ranking is either a candidate name or an iterable of names tied with each other.
+"""
+    groups = []
+    for entry in ranking:
+        if isinstance(entry, str):
+            groups.append((entry.casefold(),))
+        else:
+            group = tuple(sorted(x.casefold() for x in entry))
+            if group:
+                groups.append(group)
+    return tuple(groups)
+
+
+def _tarjan(succ):
+    """Internal function. Strongly connected components of a digraph given as adjacency lists.
+
+Components are returned sinks first (reverse topological order), as Tarjan's algorithm finds them.
+Iterative, so deep graphs do not hit the recursion limit.
+"""
+    index = [None] * len(succ)
+    low = [0] * len(succ)
+    onStack = [False] * len(succ)
+    stack = []
+    components = []
+    counter = 0
+    for root in range(len(succ)):
+        if index[root] is not None:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        onStack[root] = True
+        work = [(root, 0)]
+        while work:
+            v, pos = work[-1]
+            if pos < len(succ[v]):
+                work[-1] = (v, pos + 1)
+                w = succ[v][pos]
+                if index[w] is None:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    onStack[w] = True
+                    work.append((w, 0))
+                elif onStack[w]:
+                    low[v] = min(low[v], index[w])
+                continue
+            work.pop()
+            if work:
+                u = work[-1][0]
+                low[u] = min(low[u], low[v])
+            if low[v] == index[v]:
+                component = []
+                while True:
+                    w = stack.pop()
+                    onStack[w] = False
+                    component.append(w)
+                    if w == v:
+                        break
+                components.append(sorted(component))
+    return components
+
+
+class _HashWriter(object):
+    """Internal class. Binary file object that feeds everything written to it into a hash."""
+
+    def __init__(self, digest):
+        self._digest = digest
+
+    def write(self, data):
+        self._digest.update(data)
+        return len(data)
 
 
 class Ballot(object):
+    """Pairwise preference tally.
+
+Candidates are interned to integer indices once (see _index) and the counts are
+held in a dense, row-major n x n matrix (see _tally). _tally[i * n + j] is the
+number of votes for candidate i over candidate j.
+
+The matrix is the narrowest signed array that holds every count, widened as counts grow
+(see _pack), and a list of exact Python values once they outgrow 64 bits. reserve() sizes
+it for a known total weight up front.
+"""
+    _capacity = 0  # counts up to this size fit without widening (see reserve)
+
     def __init__(self, ordered_candidates=None, ballot_id=None):
         self.ID = ballot_id  # Tag to identify ballot. Unused internally. Could be used for serial number.
-        self._tally = {}
+        self._candidates = []
+        self._index = {}
+        self._tally = array(_TYPECODES[0])
         if ordered_candidates is None:
             # Empty ballot.
-            self._candidates = []
             return
-        self._candidates = list(map((lambda x: x.casefold()), ordered_candidates))
-        if len(self._candidates) != len(set(self._candidates)):
+        groups = _rankingGroups(ordered_candidates)
+        candidates = [x for group in groups for x in group]
+        if len(candidates) != len(set(candidates)):
             raise ValueError("Duplicate candidates on ballot")
-        for i in range(len(self._candidates) - 1):
-            for j in range(i + 1, len(self._candidates)):
-                self._set(self._candidates[i], self._candidates[j], 1)
+        self._grow(candidates)
+        n = len(candidates)
+        if len(groups) < n:
+            # Ballot with ties
+            self._addGroups([[self._index[x] for x in group] for group in groups])
+            return
+        one = array(self._tally.typecode, [1])
+        for i in range(n - 1):
+            # Candidate i is preferred over every candidate ranked below it.
+            self._tally[i * n + i + 1:(i + 1) * n] = one * (n - i - 1)
+        return
+
+    @classmethod
+    def _blank(cls, candidates):
+        """ Internal function. Return a ballot holding candidates with every count set to zero."""
+        result = cls()
+        result._grow(candidates)
+        return result
+
+    @classmethod
+    def fromRankings(cls, rankings, candidates=None):
+        """Tally many ranked ballots at once.
+
+Keyword arguments:
+rankings -- iterable of rankings (most preferred first), or a mapping of ranking -> number of voters.
+candidates -- full candidate list. Required when rankings may leave candidates out.
+
+Identical rankings are counted first, so each distinct ranking is expanded into pairwise votes only once.
+See addRanking() for ties and truncated rankings.
+"""
+        counts = Counter()
+        if hasattr(rankings, 'items'):
+            for ranking, weight in rankings.items():
+                counts[_rankingGroups(ranking)] += weight
+        else:
+            counts.update(_rankingGroups(ranking) for ranking in rankings)
+        result = cls._blank(x.casefold() for x in candidates) if candidates is not None else cls()
+        result.reserve(sum(abs(weight) for weight in counts.values()))
+        for ranking, weight in counts.items():
+            result.addRanking(ranking, weight)
+        return result
+
+    def _grow(self, candidates):
+        """ Internal function. Append new (casefolded) candidates with zero counts."""
+        new = [c for c in dict.fromkeys(candidates) if c not in self._index]
+        if not new:
+            return
+        old = len(self._candidates)
+        n = old + len(new)
+        if isinstance(self._tally, array):
+            tally = array(self._tally.typecode, bytes(self._tally.itemsize * n * n))
+        else:
+            tally = [0] * (n * n)
+        for i in range(old):
+            tally[i * n:i * n + old] = self._tally[i * old:(i + 1) * old]
+        self._tally = tally
+        for c in new:
+            self._index[c] = len(self._candidates)
+            self._candidates.append(c)
+        return
+
+    def _drop(self, candidates):
+        """ Internal function. Remove candidates (and all their pairings) in a single pass."""
+        gone = {self._index[c] for c in candidates}
+        if not gone:
+            return
+        n = len(self._candidates)
+        keep = [i for i in range(n) if i not in gone]
+        tally = self._tally
+        self._tally = _pack((tally[i * n + j] for i in keep for j in keep), self._capacity)
+        self._candidates = [self._candidates[i] for i in keep]
+        self._index = {c: i for i, c in enumerate(self._candidates)}
+        return
+
+    @classmethod
+    def _fromTally(cls, candidates, tally):
+        """ Internal function. Return a ballot of (casefolded) candidates over a flat row-major tally, taken as is."""
+        result = cls()
+        result._candidates = list(candidates)
+        result._index = {c: i for i, c in enumerate(result._candidates)}
+        result._tally = tally
+        return result
+
+    def _subset(self, keep):
+        """ Internal function. Return a new ballot of only the candidates at positions keep, in that order."""
+        n = len(self._candidates)
+        if isinstance(self._tally, array) and _numpy() is not None:
+            tally = array(self._tally.typecode, _asNumpy(self._tally, n)[_np.ix_(keep, keep)].tobytes())
+        else:
+            tally = _pack(self._tally[i * n + j] for i in keep for j in keep)
+        return Ballot._fromTally([self._candidates[i] for i in keep], tally)
+
+    def _rename(self, names):
+        """ Internal function. Give the candidates new (casefolded) names, in candidate order."""
+        names = [x.casefold() for x in names]
+        if len(names) != len(self._candidates) or len(set(names)) != len(names):
+            raise ValueError('Need one distinct name per candidate')
+        self._candidates = names
+        self._index = {c: i for i, c in enumerate(names)}
         return
 
     def _set(self, primary, secondary, votes):
         """ Internal function. Not intended for use outside of class."""
         primary = primary.casefold()
         secondary = secondary.casefold()
-        self._tally[(primary, secondary)] = votes
-        if primary not in self._candidates:
-            self._candidates.append(primary)
-        if secondary not in self._candidates:
-            self._candidates.append(secondary)
+        self._grow((primary, secondary))
+        i = self._index[primary] * len(self._candidates) + self._index[secondary]
+        try:
+            self._tally[i] = votes
+        except (OverflowError, TypeError):
+            # votes do not fit the compact array. Widen it, or fall back to exact Python values.
+            t = list(self._tally)
+            t[i] = votes
+            self._tally = _pack(t, self._capacity)
         return
 
+    def _pairs(self):
+        """ Internal function. Yield ((primary, secondary), votes) for every non-zero count."""
+        n = len(self._candidates)
+        for i, primary in enumerate(self._candidates):
+            row = self._tally[i * n:(i + 1) * n]
+            for j, votes in enumerate(row):
+                if votes:
+                    yield (primary, self._candidates[j]), votes
+
     def __str__(self):
-        return str(dict(self._tally.items()))
+        return str(dict(self._pairs()))
 
     def __add__(self, other):
+        if isinstance(other, SparseBallot):
+            other = other.dense()
         if len(set.symmetric_difference(set(self._candidates),
                                         set(other._candidates))) != 0:
             raise ValueError("Unable to combine. Candidates on ballots do not match")
         result = Ballot()
         result._candidates = self._candidates.copy()
-        preferences = set(list(self._tally.keys()) + list(other._tally.keys()))
-        for matchup in preferences:
-            result._tally[matchup] = self.get(matchup[0], matchup[1]) + \
-                                     other.get(matchup[0], matchup[1])
+        result._index = self._index.copy()
+        if self._candidates == other._candidates:
+            theirs = other._tally
+        else:
+            # Same candidates in a different order. Permute the other matrix onto ours.
+            n = len(self._candidates)
+            order = [other._index[c] for c in self._candidates]
+            theirs = [other._tally[i * n + j] for i in order for j in order]
+        result._tally = _pack(map(operator.add, self._tally, theirs))
         return result
 
     def __mul__(self, other):
         result = Ballot()
-        for k in self._tally:
-            result._tally[k] = self._tally[k] * other
-        result._candidates = self.candidates()
+        result._tally = _pack(v * other for v in self._tally)
+        result._candidates = self._candidates.copy()
+        result._index = self._index.copy()
         return result
 
     def __rmul__(self, other):
         return self * other
 
     def __eq__(self, other):
-        return self._tally.items() == other._tally.items()
+        if isinstance(other, SparseBallot):
+            return other == self
+        if set(self._candidates) != set(other._candidates):
+            return False
+        if self._candidates == other._candidates:
+            return list(self._tally) == list(other._tally)
+        return dict(self._pairs()) == dict(other._pairs())
 
     def __ne__(self, other):
         return not self == other
@@ -69,13 +525,9 @@ class Ballot(object):
 
     def remove(self, candidate):
         """Remove candidate from ballot and all associated pairings """
-        if candidate not in self._candidates:
+        if candidate not in self._index:
             raise KeyError('Candidate not found')
-        self._candidates.remove(candidate)
-        matchups = list(self._tally.keys())
-        for matchup in matchups:
-            if candidate in matchup:
-                del self._tally[matchup]
+        self._drop([candidate])
         return
 
     def extend(self, candidates, weight=1):
@@ -91,52 +543,255 @@ New candidates will all be tied with each other and tied for last place.
         if not hasattr(candidates, '__iter__'):
             candidates = [candidates]
         candidates = [x.casefold() for x in candidates]
-        new = list(set.difference(set(candidates), set(self._candidates)))
-        for n in new:
-            for c in self._candidates:
-                self._tally[(c, n)] = weight
-        self._candidates.extend(new)
+        old = len(self._candidates)
+        self._grow(candidates)
+        n = len(self._candidates)
+        if n == old or not weight:
+            return
+        self._makeRoom(abs(weight))
+        row = [weight] * (n - old)
+        if isinstance(self._tally, array):
+            try:
+                row = array(self._tally.typecode, row)
+            except TypeError:
+                # fractional weight
+                self._tally = list(self._tally)
+        for i in range(old):
+            self._tally[i * n + old:(i + 1) * n] = row
+        return
+
+    def reserve(self, weight):
+        """Size the tally for ballots of up to weight in total, so accumulating them never widens it.
+
+Counts start in the narrowest array that holds them and are widened as they grow. Declaring the
+total weight up front picks the final width at once. Larger counts are still widened as needed.
+"""
+        self._capacity = max(self._capacity, abs(weight))
+        self._makeRoom(self._capacity)
+        return
+
+    def _makeRoom(self, bound):
+        """ Internal function. Widen a compact tally, if need be, to hold any count from -bound to bound."""
+        t = self._tally
+        if isinstance(t, array) and bound >= 1 << (8 * t.itemsize - 1):
+            self._tally = _pack(t, max(bound, self._capacity))
+        return
+
+    def addRanking(self, ordered_candidates, weight=1):
+        """Add one ranked ballot to the tally in place.
+
+Keyword arguments:
+ordered_candidates -- candidates on the ballot, most preferred first. An entry may also be a
+                      list of candidates who are tied with each other.
+weight -- number of voters casting this ranking.
+
+Candidates left off the ballot are tied with each other below every ranked candidate.
+Equivalent to self += Ballot(ordered_candidates) * weight without building the intermediate ballot.
+An empty ballot takes its candidate list from the first ranking added.
+"""
+        groups = _rankingGroups(ordered_candidates)
+        ranking = [x for group in groups for x in group]
+        if len(ranking) != len(set(ranking)):
+            raise ValueError("Duplicate candidates on ballot")
+        if not self._candidates:
+            self._grow(ranking)
+        index = self._index
+        if not all(c in index for c in ranking):
+            raise ValueError("Unable to combine. Candidates on ballots do not match")
+        if len(groups) == len(ranking) == len(index):
+            self._addOrder([index[c] for c in ranking], weight)
+        else:
+            self._addGroups([[index[c] for c in group] for group in groups], weight)
+        return
+
+    def _addOrder(self, order, weight=1):
+        """ Internal function. Add a full ranking given as candidate indices, most preferred first.
+
+order may be any sequence of ints, including a memoryview into a ballot log. It is not validated.
+"""
+        n = len(self._candidates)
+        self._increment([i * n + j for a, i in enumerate(order) for j in order[a + 1:]], weight)
+        return
+
+    def _addGroups(self, groups, weight=1):
+        """ Internal function. Add a ranking given as tied groups of candidate indices, most preferred first.
+
+Unranked candidates are tied below every group. Each ranked candidate's row is added in one slice to a
+row holding weight at every candidate below it, so the cost is O(ranked x candidates) in slice
+operations however short the ballot is, with no per-cell Python loop. Not validated.
+"""
+        n = len(self._candidates)
+
+        def added(t, pack):
+            below = [weight] * n  # weight for every candidate below the group being added, 0 elsewhere
+            for group in groups:
+                for j in group:
+                    below[j] = 0
+            rows = []
+            for group in reversed(groups):
+                for i in group:
+                    rows.append((i * n, pack(map(operator.add, t[i * n:(i + 1) * n], below))))
+                for j in group:
+                    below[j] = weight
+            return rows
+
+        t = self._tally
+        try:
+            rows = added(t, (lambda row: array(t.typecode, row)) if isinstance(t, array) else list)
+        except (OverflowError, TypeError):
+            # weight pushes a count out of the compact array. Add on exact Python values, then widen.
+            t = list(t)
+            rows = added(t, list)
+        for base, row in rows:
+            t[base:base + n] = row
+        if t is not self._tally:
+            self._tally = _pack(t, self._capacity)
+        return
+
+    def _addBatch(self, rankings):
+        """ Internal function. Add many rankings, each (tied groups of candidate indices, weight), in one pass.
+
+The weights of each ranked candidate are summed per row and broadcast across the row once for the
+whole batch, so a ballot itself only takes back the cells of candidates ranked level with or above
+it. A batch costs O(n^2) plus O(ranked^2) per ballot instead of O(ranked x n) per ballot. Not validated.
+"""
+        n = len(self._candidates)
+        rowWeight = [0] * n
+        cells = {}
+        for groups, weight in rankings:
+            seen = []
+            for group in groups:
+                seen.extend(group)
+                for i in group:
+                    rowWeight[i] += weight
+                    base = i * n
+                    for j in seen:
+                        if j != i:
+                            cells[base + j] = cells.get(base + j, 0) - weight
+        values = list(self._tally)
+        for i, weight in enumerate(rowWeight):
+            if weight:
+                base = i * n
+                values[base:base + n] = [v + weight for v in values[base:base + n]]
+                values[base + i] -= weight
+        for k, weight in cells.items():
+            values[k] += weight
+        self._tally = _pack(values, self._capacity)
+        return
+
+    def _increment(self, cells, weight):
+        """ Internal function. Add weight to every listed cell of the tally."""
+        t = self._tally
+        done = 0
+        try:
+            for done, k in enumerate(cells):
+                t[k] += weight
+        except (OverflowError, TypeError):
+            # weight pushed a count out of the compact array. Finish on exact Python values, then widen.
+            t = list(t)
+            for k in cells[done:]:
+                t[k] += weight
+            self._tally = _pack(t, self._capacity)
+        return
+
+    def _compact(self):
+        """ Internal function. Move a list tally back into a compact array if its counts fit one again.
+
+Changes leave a list tally as it is, since checking every count after each would cost O(n^2) per change.
+Called where the whole tally is read anyway.
+"""
+        if not isinstance(self._tally, array):
+            self._tally = _pack(self._tally, self._capacity)
+        return
 
     def printReport(self):
         candidates = sorted(self.candidates())
         if not len(candidates):
             return
-        n = len(candidates)
-        print('\t*,', end='')
-        print('\t*,'.join(candidates))
-        for c in candidates:
-            print(c + ',*', end='\t')
-            for col in candidates:
-                if col == c:
-                    print('--\t', end='')
-                else:
-                    print(self.get(c, col), end='\t')
-            print()
+        n = len(self._candidates)
+        index = [self._index[c] for c in candidates]
+        lines = ['\t*,' + '\t*,'.join(candidates)]
+        for c, i in zip(candidates, index):
+            row = self._tally[i * n:(i + 1) * n]
+            lines.append(c + ',*\t' + ''.join('--\t' if i == j else '{}\t'.format(row[j]) for j in index))
+        print('\n'.join(lines))
         return
 
     def copy(self):
         '''create shallow copy of Ballot'''
         returnBallot = Ballot()
         returnBallot._candidates = self._candidates.copy()
-        returnBallot._tally = self._tally.copy()
+        returnBallot._index = self._index.copy()
+        returnBallot._tally = self._tally[:]
         return returnBallot
 
+    def dump(self, fout):
+        """Write the tally to a binary file object. Read it back with Ballot.load()"""
+        self._compact()
+        compact = isinstance(self._tally, array)
+        header = {'candidates': self._candidates,
+                  'typecode': self._tally.typecode if compact else None,
+                  'byteorder': sys.byteorder}
+        if compact:
+            body = self._tally.tobytes()
+        else:
+            body, fractions = _dumpCounts(self._tally)
+            if fractions:
+                header['fractions'] = True
+        fout.write(json.dumps(header).encode('utf-8'))
+        fout.write(b'\n')
+        fout.write(body)
+        return
+
+    @classmethod
+    def load(cls, fin):
+        """Read a tally written by Ballot.dump() from a binary file object"""
+        header = json.loads(fin.readline().decode('utf-8'))
+        if header.get('sparse'):
+            return SparseBallot._undump(header, _loadCounts(fin.read(), header.get('fractions')))
+        result = cls._blank([])
+        result._candidates = header['candidates']
+        result._index = {c: i for i, c in enumerate(result._candidates)}
+        n = len(result._candidates)
+        if header['typecode']:
+            tally = array(header['typecode'])
+            tally.frombytes(fin.read(tally.itemsize * n * n))
+            if header['byteorder'] != sys.byteorder:
+                tally.byteswap()
+        else:
+            tally = _loadCounts(fin.read(), header.get('fractions'))
+        if len(tally) != n * n:
+            raise ValueError('Truncated tally')
+        result._tally = tally
+        return result
+
+    def fingerprint(self):
+        """Return a hex digest of the candidates (in order) and every count, as written by dump()"""
+        import hashlib
+        digest = hashlib.sha256()
+        ballot = self
+        if not isinstance(self, SparseBallot):
+            self._compact()
+            if isinstance(self._tally, array) and self._tally.typecode != 'q':
+                # hash every width as 64-bit counts, so equal tallies share a fingerprint however they are stored
+                ballot = Ballot._fromTally(self._candidates, array('q', self._tally))
+        ballot.dump(_HashWriter(digest))
+        return digest.hexdigest()
+
     def popLosers(self):
         """Pop obvious losers off the ballot and return a list of deleted candidates"""
-
-        candidates = self.candidates()
+        n = len(self._candidates)
+        t = self._tally
         delList = []
-        for i in candidates:
+        for i in range(n):
             remove = True
-            for j in candidates:
-                if i != j:
-                    if self.get(i, j) > self.get(j, i):
-                        remove = False
-                        break
+            for j in range(n):
+                if i != j and t[i * n + j] > t[j * n + i]:
+                    remove = False
+                    break
             if remove:
-                delList.append(i)
-        for i in delList:
-            self.remove(i)
+                delList.append(self._candidates[i])
+        self._drop(delList)
         return delList
 
     def popWinner(self):
@@ -145,17 +800,17 @@ New candidates will all be tied with each other and tied for last place.
 Pop and return candidate which beats all other candidates off ballot.
 If no obvious winner found, return None
 """
-        candidates = self.candidates()
+        n = len(self._candidates)
+        t = self._tally
         delList = []
-        for i in candidates:
+        for i in range(n):
             remove = True
-            for j in candidates:
-                if i != j:
-                    if self.get(i, j) <= self.get(j, i):
-                        remove = False  # This candidate is beaten by or ties at least one other candidate
-                        break
+            for j in range(n):
+                if i != j and t[i * n + j] <= t[j * n + i]:
+                    remove = False  # This candidate is beaten by or ties at least one other candidate
+                    break
             if remove:
-                delList.append(i)
+                delList.append(self._candidates[i])
         if len(delList) > 1:
             # More than one obvious winner has been produced. This shouldn't happen
             raise RuntimeError("More than one winner found")
@@ -167,54 +822,886 @@ If no obvious winner found, return None
 
     def get(self, primary, secondary):
         """return number of votes for primary over secondary """
-        if primary not in self._candidates or secondary not in self._candidates:
+        try:
+            return self._tally[self._index[primary] * len(self._candidates) + self._index[secondary]]
+        except KeyError:
+            raise KeyError((primary, secondary)) from None
+
+
+class _ScoreIndex(object):
+    """Internal class. Candidates of a SparseBallot sorted by how often they were ranked.
+
+A Fenwick tree over the sorted positions counts the candidates still present, so pruning can ask
+"how many candidates were ranked less often than this one" in O(log n) as candidates are removed.
+"""
+
+    def __init__(self, names, scores, degree):
+        self.names = names
+        self.scores = scores
+        self.degree = degree  # most candidates any one candidate was ranked together with
+        self.low = 0  # every position before low has been removed
+        self.high = len(names) - 1  # every position after high has been removed
+        self.left = len(names)
+        self._position = {c: p for p, c in enumerate(names)}
+        self._tree = [0] * (len(names) + 1)
+        for i in range(1, len(names) + 1):
+            self._tree[i] += 1
+            parent = i + (i & -i)
+            if parent <= len(names):
+                self._tree[parent] += self._tree[i]
+
+    def remove(self, name):
+        self.left -= 1
+        i = self._position[name] + 1
+        while i < len(self._tree):
+            self._tree[i] -= 1
+            i += i & -i
+        return
+
+    def below(self, p):
+        """Number of candidates present that were ranked less often than the one at position p"""
+        i = bisect.bisect_left(self.scores, self.scores[p])
+        count = 0
+        while i > 0:
+            count += self._tree[i]
+            i -= i & -i
+        return count
+
+
+class SparseBallot(Ballot):
+    """Pairwise preference tally for polls with very many candidates and short ballots.
+
+Only candidates ranked on the same ballot get explicit pair counts. Every other count follows from
+how often each candidate was ranked at all, since a ranked candidate beats every unranked one:
+
+    votes(a, b) = over[a][b] + ranked(a) - together(a, b)
+
+where over[a][b] counts ballots ranking a above b, ranked(a) counts ballots ranking a that were cast
+while b was a candidate, and together(a, b) counts ballots ranking both. Memory grows with the ballot
+contents instead of the square of the candidate count. Pruning (popLosers(), popWinner()) compares
+candidates by these totals instead of pair by pair; dense() expands the tally into a Ballot.
+
+Candidates are best declared up front with SparseBallot._blank(). Candidates added once votes exist
+start a new era, and a tally with more than one era prunes by comparing every pair.
+"""
+
+    def __init__(self, ordered_candidates=None, ballot_id=None):
+        self.ID = ballot_id  # Tag to identify ballot. Unused internally. Could be used for serial number.
+        self._order = {}  # candidate -> position, in candidate order
+        self._names = []  # candidate at each position, None once removed
+        self._generation = {}  # candidate -> era it was added in
+        self._era = 0
+        self._above = {}  # candidate -> {era: votes ranking it over every unranked candidate}
+        self._over = {}  # candidate -> {other: votes ranking it above other}
+        self._together = {}  # candidate -> {other: votes ranking both}. Keys are kept symmetric.
+        self._offset = {}  # era -> extend() weight shared by every pair that existed before the era began
+        self._sorted = None  # _ScoreIndex, built on the first popLosers()/popWinner()
+        if ordered_candidates is None:
+            # Empty ballot.
+            return
+        groups = _rankingGroups(ordered_candidates)
+        candidates = [x for group in groups for x in group]
+        if len(candidates) != len(set(candidates)):
+            raise ValueError("Duplicate candidates on ballot")
+        self._grow(candidates)
+        self._addNamed(groups, 1)
+        return
+
+    @property
+    def _candidates(self):
+        return list(self._order)
+
+    def _add(self, candidates):
+        """ Internal function. Register new candidates in the current era."""
+        for c in candidates:
+            self._order[c] = len(self._names)
+            self._names.append(c)
+            self._generation[c] = self._era
+        self._sorted = None
+        return
+
+    def _grow(self, candidates):
+        """ Internal function. Append new (casefolded) candidates with zero counts."""
+        new = [c for c in dict.fromkeys(candidates) if c not in self._order]
+        if not new:
+            return
+        if self._above or self._over:
+            self._era += 1  # ballots cast so far say nothing about the new candidates
+        self._add(new)
+        return
+
+    def _drop(self, candidates):
+        """ Internal function. Remove candidates and their pair counts, in time proportional to those counts."""
+        for c in candidates:
+            self._names[self._order.pop(c)] = None
+            del self._generation[c]
+            self._above.pop(c, None)
+            self._over.pop(c, None)
+            for other in self._together.pop(c, {}):
+                self._together[other].pop(c, None)
+                self._over.get(other, {}).pop(c, None)
+            if self._sorted is not None:
+                self._sorted.remove(c)
+        return
+
+    def _rename(self, names):
+        """ Internal function. Give the candidates new (casefolded) names, in candidate order."""
+        names = [x.casefold() for x in names]
+        if len(names) != len(self._order) or len(set(names)) != len(names):
+            raise ValueError('Need one distinct name per candidate')
+        new = dict(zip(self._order, names))
+        self._order = {new[c]: p for c, p in self._order.items()}
+        self._names = [None if c is None else new[c] for c in self._names]
+        self._generation = {new[c]: g for c, g in self._generation.items()}
+        for counts in (self._over, self._together):
+            for c in list(counts):
+                counts[c] = {new[d]: v for d, v in counts[c].items()}
+        for counts in (self._above, self._over, self._together):
+            renamed = {new[c]: v for c, v in counts.items()}
+            counts.clear()
+            counts.update(renamed)
+        self._sorted = None
+        return
+
+    def _score(self, c):
+        """ Internal function. Votes ranking c at all, for a single era tally."""
+        return self._above.get(c, {}).get(0, 0)
+
+    def _votes(self, primary, secondary):
+        """ Internal function. Votes for primary over secondary, both known and distinct."""
+        votes = self._over.get(primary, {}).get(secondary, 0) - self._together.get(primary, {}).get(secondary, 0)
+        above = self._above.get(primary)
+        if above and self._era:
+            since = self._generation[secondary]
+            votes += sum(v for era, v in above.items() if era >= since)
+        elif above:
+            votes += above.get(0, 0)
+        if self._offset:
+            since = max(self._generation[primary], self._generation[secondary])
+            votes -= sum(v for era, v in self._offset.items() if era >= since)
+        return votes
+
+    def _set(self, primary, secondary, votes):
+        """ Internal function. Not intended for use outside of class."""
+        primary = primary.casefold()
+        secondary = secondary.casefold()
+        self._grow((primary, secondary))
+        over = self._over.setdefault(primary, {})
+        over[secondary] = over.get(secondary, 0) + votes - self._votes(primary, secondary)
+        self._together.setdefault(primary, {}).setdefault(secondary, 0)
+        self._together.setdefault(secondary, {}).setdefault(primary, 0)
+        self._sorted = None
+        return
+
+    def _pairs(self):
+        """ Internal function. Yield ((primary, secondary), votes) for every non-zero count."""
+        for primary in self._order:
+            for secondary in self._order:
+                if primary != secondary:
+                    votes = self._votes(primary, secondary)
+                    if votes:
+                        yield (primary, secondary), votes
+
+    def _addNamed(self, groups, weight):
+        """ Internal function. Add a ranking given as tied groups of candidate names. Not validated."""
+        era = self._era
+        ranked = []
+        for group in groups:
+            for a in group:
+                above = self._above.setdefault(a, {})
+                above[era] = above.get(era, 0) + weight
+            for b in ranked:
+                over = self._over.setdefault(b, {})
+                for a in group:
+                    over[a] = over.get(a, 0) + weight
+            ranked.extend(group)
+        for a in ranked:
+            together = self._together.setdefault(a, {})
+            for b in ranked:
+                if a != b:
+                    together[b] = together.get(b, 0) + weight
+        self._sorted = None
+        return
+
+    def _addOrder(self, order, weight=1):
+        """ Internal function. Add a ranking given as candidate positions, most preferred first. Not validated."""
+        self._addNamed([(self._names[i],) for i in order], weight)
+        return
+
+    def _addGroups(self, groups, weight=1):
+        """ Internal function. Add a ranking given as tied groups of candidate positions. Not validated."""
+        self._addNamed([[self._names[i] for i in group] for group in groups], weight)
+        return
+
+    def _addBatch(self, rankings):
+        """ Internal function. Add many rankings, each (tied groups of candidate positions, weight). Not validated."""
+        for groups, weight in rankings:
+            self._addGroups(groups, weight)
+        return
+
+    def addRanking(self, ordered_candidates, weight=1):
+        """Add one ranked ballot to the tally in place, in time proportional to the ranked pairs.
+
+See Ballot.addRanking().
+"""
+        groups = _rankingGroups(ordered_candidates)
+        ranking = [x for group in groups for x in group]
+        if len(ranking) != len(set(ranking)):
+            raise ValueError("Duplicate candidates on ballot")
+        if not self._order:
+            self._grow(ranking)
+        if not all(c in self._order for c in ranking):
+            raise ValueError("Unable to combine. Candidates on ballots do not match")
+        self._addNamed(groups, weight)
+        return
+
+    def _merge(self, other):
+        """ Internal function. Add the counts of a sparse tally with the same candidates and eras."""
+        for mine, theirs in ((self._above, other._above), (self._over, other._over),
+                             (self._together, other._together)):
+            for c, counts in theirs.items():
+                target = mine.setdefault(c, {})
+                for k, v in counts.items():
+                    target[k] = target.get(k, 0) + v
+        for era, v in other._offset.items():
+            self._offset[era] = self._offset.get(era, 0) + v
+        self._sorted = None
+        return
+
+    def __add__(self, other):
+        if not isinstance(other, SparseBallot):
+            return self.dense() + other
+        if set(self._order) != set(other._order):
+            raise ValueError("Unable to combine. Candidates on ballots do not match")
+        if self._generation != other._generation:
+            # Different histories of added candidates. Combine the explicit counts instead.
+            return self.dense() + other.dense()
+        result = self.copy()
+        result._merge(other)
+        return result
+
+    def __mul__(self, other):
+        result = self.copy()
+        for counts in (result._above, result._over, result._together):
+            for c in counts:
+                counts[c] = {k: v * other for k, v in counts[c].items()}
+        result._offset = {era: v * other for era, v in result._offset.items()}
+        return result
+
+    def __eq__(self, other):
+        return self.dense() == (other.dense() if isinstance(other, SparseBallot) else other)
+
+    def remove(self, candidate):
+        """Remove candidate from ballot and all associated pairings """
+        if candidate not in self._order:
+            raise KeyError('Candidate not found')
+        self._drop([candidate])
+        return
+
+    def reserve(self, weight):
+        """Counts are exact Python values, which never need widening. See Ballot.reserve()."""
+        return
+
+    def extend(self, candidates, weight=1):
+        """Add candidate(s) to the candidate list such that they are all tied for last.
+
+See Ballot.extend(). The new candidates start a new era, so this touches each existing candidate
+once rather than every pair.
+"""
+        if not hasattr(candidates, '__iter__'):
+            candidates = [candidates]
+        new = [c for c in dict.fromkeys(x.casefold() for x in candidates) if c not in self._order]
+        if not new:
+            return
+        if not weight:
+            self._grow(new)
+            return
+        self._era += 1
+        # every existing candidate is ranked over the newcomers, and only over them
+        for c in self._order:
+            above = self._above.setdefault(c, {})
+            above[self._era] = above.get(self._era, 0) + weight
+        self._offset[self._era - 1] = self._offset.get(self._era - 1, 0) + weight
+        self._add(new)
+        return
+
+    def printReport(self):
+        self.dense().printReport()
+        return
+
+    def copy(self):
+        '''create shallow copy of SparseBallot'''
+        result = SparseBallot()
+        result._order = self._order.copy()
+        result._names = self._names.copy()
+        result._generation = self._generation.copy()
+        result._era = self._era
+        result._above = {c: v.copy() for c, v in self._above.items()}
+        result._over = {c: v.copy() for c, v in self._over.items()}
+        result._together = {c: v.copy() for c, v in self._together.items()}
+        result._offset = self._offset.copy()
+        return result
+
+    def dense(self):
+        """Return the same tally as a dense Ballot"""
+        names = list(self._order)
+        result = Ballot._blank(names)
+        result._tally = _pack(self._votes(a, b) if a != b else 0 for a in names for b in names)
+        return result
+
+    def dump(self, fout):
+        """Write the tally to a binary file object. Read it back with Ballot.load()"""
+        names = list(self._order)
+        header = {'candidates': names, 'sparse': True}
+        body = {'generation': [self._generation[c] for c in names],
+                'era': self._era,
+                'above': {c: list(v.items()) for c, v in self._above.items()},
+                'over': self._over,
+                'together': self._together,
+                'offset': list(self._offset.items())}
+        body, fractions = _dumpCounts(body)
+        if fractions:
+            header['fractions'] = True
+        fout.write(json.dumps(header).encode('utf-8'))
+        fout.write(b'\n')
+        fout.write(body)
+        return
+
+    @classmethod
+    def _undump(cls, header, body):
+        """ Internal function. Rebuild a tally from the parts written by dump()."""
+        result = cls()
+        result._names = header['candidates']
+        result._order = {c: i for i, c in enumerate(result._names)}
+        result._generation = dict(zip(result._names, body['generation']))
+        result._era = body['era']
+        result._above = {c: dict(v) for c, v in body['above'].items()}
+        result._over = body['over']
+        result._together = body['together']
+        result._offset = dict(body['offset'])
+        return result
+
+    def _byScore(self):
+        """ Internal function. Return the _ScoreIndex of the candidates, building it if needed."""
+        if self._sorted is None:
+            names = sorted(self._order, key=self._score)  # stable, so equal scores stay in candidate order
+            degree = max((len(v) for v in self._together.values()), default=0)
+            self._sorted = _ScoreIndex(names, [self._score(c) for c in names], degree)
+        return self._sorted
+
+    def _beats(self, primary, secondary):
+        return self._votes(primary, secondary) > self._votes(secondary, primary)
+
+    def popLosers(self):
+        """Pop obvious losers off the ballot and return a list of deleted candidates
+
+A candidate ranked more often than some candidate it never shared a ballot with beats that
+candidate, so only the least ranked candidates need their pairs checked.
+"""
+        if self._era:
+            names = list(self._order)
+            delList = [a for a in names if not any(self._beats(a, b) for b in names if a != b)]
+            self._drop(delList)
+            return delList
+        index = self._byScore()
+        delList = []
+        for p in range(index.low, index.high + 1):
+            c = index.names[p]
+            if c not in self._order:
+                if p == index.low:
+                    index.low += 1
+                continue
+            below = index.below(p)
+            if below > index.degree:
+                break  # this and every later candidate beats someone it never shared a ballot with
+            together = self._together.get(c, {})
+            if below > len(together) or below > sum(self._score(x) < index.scores[p] for x in together):
+                continue  # beats someone it never shared a ballot with
+            if not any(self._beats(c, x) for x in together):
+                delList.append(c)
+        delList.sort(key=self._order.get)
+        self._drop(delList)
+        return delList
+
+    def popWinner(self):
+        """Pop obvious winner off ballot
+
+Pop and return candidate which beats all other candidates off ballot.
+If no obvious winner found, return None
+"""
+        if self._era:
+            names = list(self._order)
+            delList = [a for a in names if all(self._beats(a, b) for b in names if a != b)]
+        else:
+            index = self._byScore()
+            delList = []
+            for p in range(index.high, index.low - 1, -1):
+                c = index.names[p]
+                if c not in self._order:
+                    if p == index.high:
+                        index.high -= 1
+                    continue
+                notBelow = index.left - index.below(p) - 1
+                if notBelow > index.degree:
+                    break  # this and every earlier candidate ties or loses to someone it never shared a ballot with
+                together = self._together.get(c, {})
+                if notBelow > len(together) or notBelow > sum(self._score(x) >= index.scores[p] for x in together):
+                    continue  # ties or loses to someone it never shared a ballot with
+                if all(self._beats(c, x) for x in together):
+                    delList.append(c)
+        if len(delList) > 1:
+            # More than one obvious winner has been produced. This shouldn't happen
+            raise RuntimeError("More than one winner found")
+        elif len(delList) == 1:
+            self.remove(delList[0])
+            return delList[0]
+        elif len(delList) == 0:
+            return None
+
+    def get(self, primary, secondary):
+        """return number of votes for primary over secondary """
+        if primary not in self._order or secondary not in self._order:
             raise KeyError((primary, secondary))
-        return self._tally.get((primary.casefold(), secondary.casefold()), 0)
+        if primary == secondary:
+            return 0
+        return self._votes(primary, secondary)
+
+
+class WeightedBallots(object):
+    """Ballots with per-voter weights that can be corrected after voting closes.
+
+The pairwise tally is kept as the sum of every voter's ranking times their weight. Changing a weight
+or retracting a ballot adds the difference for that one ranking to the tally, so it costs one
+ranking's pairs instead of a re-tally. Weights may be integers of any size or Fractions. Floats
+work too, but retracting them can leave rounding residue in the tally.
+"""
+
+    def __init__(self, candidates, sparse=False):
+        """
+Keyword arguments:
+candidates -- full candidate list
+sparse -- keep the tally in a SparseBallot
+"""
+        kind = SparseBallot if sparse else Ballot
+        self._tally = kind._blank(x.casefold() for x in candidates)
+        self._ballots = {}  # voter -> (ranking groups, weight)
+        self._rankings = {}  # distinct rankings, so identical ballots share one copy
+
+    def cast(self, voter, ranking, weight=1):
+        """Record a voter's ballot, replacing any earlier ballot of theirs
+
+Keyword arguments:
+voter -- any hashable voter ID
+ranking -- candidates most preferred first, as for Ballot.addRanking()
+weight -- the voter's weight
+"""
+        groups = _rankingGroups(ranking)
+        groups = self._rankings.setdefault(groups, groups)
+        self._tally.addRanking(groups, weight)  # validates before anything changes
+        if voter in self._ballots:
+            self.retract(voter)
+        self._ballots[voter] = (groups, weight)
+        return
+
+    def reweight(self, voter, weight):
+        """Change a voter's weight"""
+        groups, old = self._ballots[voter]
+        if weight != old:
+            self._tally.addRanking(groups, weight - old)
+            self._ballots[voter] = (groups, weight)
+        return
+
+    def retract(self, voter):
+        """Remove a voter's ballot from the tally"""
+        groups, weight = self._ballots.pop(voter)
+        self._tally.addRanking(groups, -weight)
+        return
+
+    def weight(self, voter):
+        return self._ballots[voter][1]
+
+    def ranking(self, voter):
+        """Return the voter's ranking as tied groups, most preferred first"""
+        return self._ballots[voter][0]
+
+    def __len__(self):
+        return len(self._ballots)
+
+    def __contains__(self, voter):
+        return voter in self._ballots
+
+    def tally(self):
+        """Return a copy of the weighted pairwise tally"""
+        return self._tally.copy()
+
+
+class RankingCache(object):
+    """Memoize Graph ladders by Ballot.fingerprint().
+
+Results live in an LRU of at most size entries and, if directory is given, also as one JSON file
+per fingerprint there, so they survive restarts and can be shared between processes.
+"""
+
+    def __init__(self, size=128, directory=None):
+        self.size = size
+        self.directory = directory
+        self._entries = OrderedDict()
+
+    def ladder(self, ballot, **options):
+        """Return Graph(ballot, verbose=False, **options).ladder(), computing it only for a new fingerprint"""
+        key = ballot.fingerprint()
+        result = self.get(key)
+        if result is None:
+            result = Graph(ballot, verbose=False, **options).ladder()
+            self.put(key, result)
+        return result
+
+    def get(self, key):
+        """Return the cached ladder for a fingerprint, or None"""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        if self.directory is None:
+            return None
+        try:
+            with open(self._file(key), mode='r') as fin:
+                result = tuple(self._decode(entry) for entry in json.load(fin))
+        except (OSError, ValueError):
+            return None
+        self._remember(key, result)
+        return result
+
+    def put(self, key, ladder):
+        """Store a ladder under a fingerprint"""
+        self._remember(key, ladder)
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            out_file = self._file(key)
+            with open(out_file + '.tmp', mode='w') as fout:
+                json.dump([self._encode(entry) for entry in ladder], fout)
+            os.replace(out_file + '.tmp', out_file)
+        return
+
+    def clear(self):
+        """Forget every ladder held in memory. Files on disk are kept."""
+        self._entries.clear()
+        return
+
+    def _remember(self, key, ladder):
+        self._entries[key] = ladder
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return
+
+    def _file(self, key):
+        return os.path.join(self.directory, key + '.ladder.json')
+
+    @staticmethod
+    def _encode(entry):
+        # ladder ties are lists (decided by paths) or tuples (pruned together); JSON keeps the difference here
+        if isinstance(entry, str):
+            return entry
+        return {'list' if isinstance(entry, list) else 'tuple': list(entry)}
+
+    @staticmethod
+    def _decode(entry):
+        if isinstance(entry, str):
+            return entry
+        if 'list' in entry:
+            return list(entry['list'])
+        return tuple(entry['tuple'])
+
+
+def _peakMemory():
+    """Internal function. Peak resident memory of this process in bytes, or None where unsupported."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class ConsoleMonitor(object):
+    """Print Graph progress events to stdout. Used by Graph(..., verbose=True)."""
+
+    def __call__(self, event, data):
+        if event == 'start':
+            print("\t", data['candidates'], " candidates.", sep='')
+            print("\tDropping obvious weak candidates.")
+        elif event == 'phase' and data['phase'] in ('losers', 'winners'):
+            print("\t", data['candidates'], "candidates remain")
+            if data['phase'] == 'losers' and data['candidates']:
+                print("\tRemoving obvious winners...")
+        elif event == 'winner':
+            print("\t\t", data['candidate'])
+        elif event == 'components':
+            print("\t", data['count'], " strongly connected components, largest has ", data['largest'], ".", sep='')
+        elif event == 'pivot' and data['done'] % 10 == 0:
+            import datetime
+            now = datetime.datetime.now()
+            if data['done'] == 0:
+                print("\tNullifying weak pairwise preferences...")
+                print("\tCalculating strongest paths...")
+                print("\tCandidates evaluated...")
+                print('\t\t', 0, '\t', now.strftime("%Y-%m-%d %H:%M:%S"), sep='')
+            else:
+                estCompletion = now + datetime.timedelta(seconds=data['eta'])
+                print('\t\t', data['done'], '\t', now.strftime("%Y-%m-%d %H:%M:%S"), sep='', end='')
+                print('\t', 'est finish: ', estCompletion.strftime("%Y-%m-%d %H:%M"), sep='')
+        return
+
+
+class LogMonitor(object):
+    """Forward Graph progress events to a logging.Logger.
+
+Every event is logged with its data attached as the record attributes schulze_event and schulze,
+so handlers can export them as metrics. Pivot events are logged at a lower level as there is one per candidate:
+logging.DEBUG, against logging.INFO for the rest, unless pivotLevel and level say otherwise.
+"""
+
+    def __init__(self, logger=None, level=None, pivotLevel=None):
+        import logging  # only loaded by programs that log progress
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.level = logging.INFO if level is None else level
+        self.pivotLevel = logging.DEBUG if pivotLevel is None else pivotLevel
+
+    def __call__(self, event, data):
+        level = self.pivotLevel if event == 'pivot' else self.level
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, '%s %s', event, data, extra={'schulze_event': event, 'schulze': data})
+        return
 
 
 class Graph(object):
+    """Schulze ranking of a pairwise tally.
+
+Progress is reported as events to monitor callables, monitor(event, data), where data is a dict:
+start      -- candidates
+phase      -- phase ('losers', 'winners', 'paths', 'rankings' or 'update'), wall and cpu seconds,
+              peak_rss bytes (None where unsupported) and candidates remaining or processed
+winner     -- candidate popped as an obvious winner
+components -- count and largest size of the strongly connected components left for the path step
+pivot      -- done and total pivots of the current path computation, pairs relaxed so far,
+              pairs_per_second and eta seconds
+Without monitors (and with verbose off) no timing or event data is collected at all.
+"""
     verbose = True  ##    """Provide feedback during processing."""
+    kernel = 'auto'  # Strongest path kernel: 'python', 'numpy' or 'auto'
+    kernels = ('auto', 'python', 'numpy')
+    numpyThreshold = 16  # 'auto' only switches to NumPy for more candidates than this
+    workers = 1  # Number of processes used for the strongest path step
+    parallelThreshold = 32  # workers only start for components of more candidates than this
+    batchSize = 64  # Graphs held at once by ladders()
 
-    def __init__(self, ballot, verbose=True):
+    def __init__(self, ballot, verbose=True, kernel='auto', workers=1, monitor=None):
+        if kernel not in self.kernels:
+            raise ValueError('Unknown kernel: {}'.format(kernel))
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
         self.verbose = verbose
-        self._ballot = ballot.copy()
+        self.kernel = kernel
+        self.workers = workers
+        self._monitors = ([ConsoleMonitor()] if verbose else []) + ([monitor] if monitor is not None else [])
+        self._tally = ballot.copy()  # full pairwise tally, kept for update()
+        self._paths = None  # strongest paths between every candidate, kept once update() is used
+        self._candidates = tuple(sorted(self._tally._candidates))
+        self._sparse = isinstance(self._tally, SparseBallot)
+        if self._sparse:
+            self._pruneSparse()
+        else:
+            self._prune()
+        return
+
+    def _emit(self, event, **data):
+        for monitor in self._monitors:
+            monitor(event, data)
+        return
+
+    def _startPhase(self):
+        return (time.perf_counter(), time.process_time()) if self._monitors else None
+
+    def _endPhase(self, phase, start, candidates):
+        if start is None:
+            return
+        self._emit('phase', phase=phase, wall=time.perf_counter() - start[0], cpu=time.process_time() - start[1],
+                   peak_rss=_peakMemory(), candidates=candidates)
+        return
+
+    def _prune(self):
+        """Rank and set aside obvious losers and winners, leaving the core for the path step
+
+Losers (candidates who beat nobody left) are peeled off in layers and winners (candidates who beat
+everyone left) one at a time, exactly as repeated Ballot.popLosers()/popWinner() calls would,
+but from one O(n^2) pass over the tally using per-candidate win counts.
+"""
+        t = self._tally._tally
+        names = self._tally._candidates
+        n = len(names)
         self._ladder = []
         self._ladderTop = []
-        self._candidates = tuple(sorted(self._ballot._candidates))
         self._graphCalculated = False
+        self._components = None
+        start = self._startPhase()
+
+        if isinstance(t, array) and self._useNumpy(n):
+            d = _asNumpy(t, n)
+            beats = d > d.T
+            wins = beats.sum(1).tolist()
+            beatenBy = [_np.flatnonzero(column).tolist() for column in beats.T]
+            del d, beats
+        else:
+            beatenBy = [[] for i in range(n)]
+            wins = [0] * n
+            for i in range(n):
+                for j in range(n):
+                    if i != j and t[i * n + j] > t[j * n + i]:
+                        wins[i] += 1
+                        beatenBy[j].append(i)
 
         # Eliminate and rank all obvious losers from the ballot
-        if self.verbose:
-            print("\t", len(self._candidates), " candidates.", sep='')
-            print("\tDropping obvious weak candidates.")
-        dropped = ['TEMP']
-        while dropped and self._ballot._candidates:
-            dropped = self._ballot.popLosers()
-            if dropped:
-                # insert pruned objects at top of ladder
-                if len(dropped) == 1:
-                    # Singleton. "De-listify" it.
-                    dropped = dropped[0]
-                else:
-                    dropped = tuple(dropped)
-                self._ladder.insert(0, dropped)
-        if self.verbose: print("\t", len(self._ballot._candidates), "candidates remain")
-        if not self._ballot._candidates:
+        if self._monitors: self._emit('start', candidates=n)
+        remaining = [True] * n
+        left = n
+        dropped = [i for i in range(n) if not wins[i]]
+        while dropped:
+            # insert pruned objects at top of ladder
+            if len(dropped) == 1:
+                # Singleton. "De-listify" it.
+                self._ladder.insert(0, names[dropped[0]])
+            else:
+                self._ladder.insert(0, tuple(names[i] for i in dropped))
+            for i in dropped:
+                remaining[i] = False
+            left -= len(dropped)
+            nextLayer = set()
+            for i in dropped:
+                for j in beatenBy[i]:
+                    if remaining[j]:
+                        wins[j] -= 1
+                        if not wins[j]:
+                            nextLayer.add(j)
+            dropped = sorted(nextLayer)
+        self._endPhase('losers', start, left)
+        if not left:
             # The ballot has been completely consumed.  Processing finished.
+            self._core = []
             self._graphCalculated = True
-            del self._ballot
             return
 
         # Remove obvious winners from the ballot
-        if self.verbose: print("\tRemoving obvious winners...")
-        while True:
-            winner = self._ballot.popWinner()
-            if winner:
-                if self.verbose: print("\t\t", winner)
+        start = self._startPhase()
+        core = [i for i in range(n) if remaining[i]]
+        while core:
+            # nobody beats a winner, so removing one leaves every other win count unchanged
+            winner = next((i for i in core if wins[i] == len(core) - 1), None)
+            if winner is None:
+                break  # No more winners found
+            if self._monitors: self._emit('winner', candidate=names[winner])
+            self._ladderTop.append(names[winner])
+            core.remove(winner)
+        self._endPhase('winners', start, len(core))
+        self._core = core
+        return
+
+    def _pruneSparse(self):
+        """Prune a SparseBallot with its own popLosers()/popWinner(), then expand only the core
+
+Pruning compares candidates by how often they were ranked, so it never visits all n^2 pairs.
+The dense matrix the path step needs is built for the candidates left over.
+"""
+        tally = self._tally
+        self._ladder = []
+        self._ladderTop = []
+        self._graphCalculated = False
+        self._components = None
+        start = self._startPhase()
+
+        # Eliminate and rank all obvious losers from the ballot
+        if self._monitors: self._emit('start', candidates=len(self._candidates))
+        dropped = tally.popLosers()
+        while dropped:
+            # insert pruned objects at top of ladder
+            self._ladder.insert(0, dropped[0] if len(dropped) == 1 else tuple(dropped))
+            dropped = tally.popLosers()
+        self._endPhase('losers', start, len(tally._order))
+
+        # Remove obvious winners from the ballot
+        if tally._order:
+            start = self._startPhase()
+            winner = tally.popWinner()
+            while winner is not None:
+                if self._monitors: self._emit('winner', candidate=winner)
                 self._ladderTop.append(winner)
+                winner = tally.popWinner()
+            self._endPhase('winners', start, len(tally._order))
+        self._tally = tally.dense()
+        self._core = list(range(len(self._tally._candidates)))
+        self._graphCalculated = not self._core
+        return
+
+    def update(self, changes):
+        """Apply new pairwise vote counts and update the strongest paths incrementally.
+
+Keyword arguments:
+changes -- mapping of (primary, secondary) -> new number of votes for primary over secondary,
+           or a Ballot whose votes are added to the tally.
+
+Only paths through the candidates of strengthened links are relaxed again. If any link
+weakens, every path is recomputed. The ladder is recalculated on the next call to ladder().
+Not available for a Graph of a SparseBallot, which only keeps the core of the tally.
+"""
+        if self._sparse:
+            raise TypeError('update() needs a Graph of a dense Ballot')
+        start = self._startPhase()
+        t = self._tally
+        index = t._index
+        n = len(t._candidates)
+        if self._paths is None:
+            self._paths = self._strongestPaths(t._tally, n)
+        if isinstance(changes, Ballot):
+            if set(changes._candidates) != set(t._candidates):
+                raise ValueError("Unable to combine. Candidates on ballots do not match")
+            changes = {pair: t.get(*pair) + votes for pair, votes in changes._pairs()}
+        cells = {}
+        for (primary, secondary), votes in changes.items():
+            if primary not in index or secondary not in index or primary == secondary:
+                raise KeyError((primary, secondary))
+            cells[index[primary] * n + index[secondary]] = votes
+
+        def links():
+            tally = t._tally
+            return {(i, j): tally[i * n + j] if tally[i * n + j] > tally[j * n + i] else 0
+                    for k in cells for i, j in (divmod(k, n), divmod(k, n)[::-1])}
+
+        before = links()
+        for k, votes in cells.items():
+            i, j = divmod(k, n)
+            t._set(t._candidates[i], t._candidates[j], votes)
+        after = links()
+
+        if any(after[link] < before[link] for link in after):
+            self._paths = self._strongestPaths(t._tally, n)
+        else:
+            # make room for the new strengths, widening the path container if need be
+            paths = self._paths = _pack(self._paths, max(after.values(), default=0))
+            pivots = set()
+            for (i, j), strength in after.items():
+                if strength > before[(i, j)]:
+                    pivots.update((i, j))
+                    paths[i * n + j] = max(paths[i * n + j], strength)
+            if pivots and self._useNumpy(n):
+                p = _asNumpy(paths, n)
+                for i in sorted(pivots):
+                    _relaxNumpy(p, i)
+                _np.fill_diagonal(p, 0)
+                self._paths = _pack(p.ravel().tolist())
             else:
-                break  # No more winners found
-        if self.verbose: print("\t", len(self._ballot._candidates), "candidates remain")
+                for i in sorted(pivots):
+                    _relaxPython(paths, n, i)
+        self._endPhase('update', start, n)
+        self._prune()
         return
 
     def ladder(self):
@@ -229,79 +1716,288 @@ Ties are returned as lists within the ladder.
     def candidates(self):
         return self._candidates
 
+    def _fullPaths(self):
+        """Return the strongest path matrix between every candidate of the tally, computing it on first use"""
+        if self._sparse:
+            raise TypeError('Path queries need a Graph of a dense Ballot')
+        if self._paths is None:
+            self._paths = self._strongestPaths(self._tally._tally, len(self._tally._candidates))
+        return self._paths
+
+    def _pair(self, primary, secondary):
+        index = self._tally._index
+        try:
+            return index[primary], index[secondary]
+        except KeyError:
+            raise KeyError((primary, secondary)) from None
+
+    def strength(self, primary, secondary):
+        """Return the strength of the strongest path from primary to secondary, p[primary][secondary]
+
+The first query computes paths between every candidate, obvious winners and losers included.
+Later queries are lookups, and update() keeps the paths current.
+"""
+        i, j = self._pair(primary, secondary)
+        return self._fullPaths()[i * len(self._tally._candidates) + j] if i != j else 0
+
+    def margin(self, primary, secondary):
+        """Return votes for primary over secondary minus votes for secondary over primary"""
+        i, j = self._pair(primary, secondary)
+        n = len(self._tally._candidates)
+        t = self._tally._tally
+        return t[i * n + j] - t[j * n + i]
+
+    def witness(self, primary, secondary):
+        """Return a strongest path from primary to secondary as a list of candidates, or None if there is none
+
+Every link on the path is a pairwise win at least as strong as the path itself, and no such path
+has fewer links.
+"""
+        i, j = self._pair(primary, secondary)
+        n = len(self._tally._candidates)
+        strength = self._fullPaths()[i * n + j] if i != j else 0
+        if not strength:
+            return None
+        t = self._tally._tally
+        previous = {i: None}
+        frontier = [i]
+        while j not in previous:
+            reached = []
+            for a in frontier:
+                for b in range(n):
+                    if b not in previous and t[a * n + b] >= strength and t[a * n + b] > t[b * n + a]:
+                        previous[b] = a
+                        reached.append(b)
+            frontier = reached
+        path = [j]
+        while previous[path[-1]] is not None:
+            path.append(previous[path[-1]])
+        names = self._tally._candidates
+        return [names[a] for a in reversed(path)]
+
+    def topK(self, k):
+        """Return the candidates in the top k places of the ladder. A tie straddling place k is included whole."""
+        top = []
+        for entry in self.ladder():
+            if len(top) >= k:
+                break
+            top.extend([entry] if isinstance(entry, str) else entry)
+        return top
+
+    def pathMatrix(self):
+        """Return (candidates, strongest path matrix) over every candidate, rows and columns in that order.
+
+The matrix is a read-only view of the Graph's own paths, not a copy: an n x n NumPy array when NumPy
+is installed, else a 2-D memoryview. Paths too large for 64 bits come as an n x n NumPy object array
+or a tuple of row tuples instead, which are copies.
+"""
+        return self._tally.candidates(), self._export(self._fullPaths())
+
+    def pairwiseMatrix(self):
+        """Return (candidates, pairwise tally matrix) over every candidate. See pathMatrix() for the matrix type."""
+        if self._sparse:
+            raise TypeError('The full pairwise matrix needs a Graph of a dense Ballot')
+        return self._tally.candidates(), self._export(self._tally._tally)
+
+    def marginMatrix(self):
+        """Return (candidates, matrix of margin(row, column)) over every candidate, as a NumPy array when available"""
+        candidates, matrix = self.pairwiseMatrix()
+        if _numpy() is not None:
+            return candidates, matrix - matrix.T
+        n = len(candidates)
+        t = self._tally._tally
+        return candidates, tuple(tuple(t[i * n + j] - t[j * n + i] for j in range(n)) for i in range(n))
+
+    def _export(self, values):
+        n = len(self._tally._candidates)
+        np = _numpy()
+        if isinstance(values, array):
+            view = memoryview(values).toreadonly()
+            if np is not None:
+                return np.frombuffer(view, dtype=values.typecode).reshape(n, n)
+            return view.cast('B').cast(values.typecode, (n, n)) if n else view
+        if np is not None:
+            matrix = np.array(values, dtype=object).reshape(n, n)
+            matrix.flags.writeable = False
+            return matrix
+        return tuple(tuple(values[i * n:(i + 1) * n]) for i in range(n))
+
+    def _useNumpy(self, n):
+        """Decide whether the strongest path step runs on the NumPy kernel"""
+        if self.kernel == 'python':
+            return False
+        if self.kernel == 'numpy':
+            if _numpy() is None:
+                raise ImportError("The 'numpy' kernel requires NumPy")
+            return True
+        return n > self.numpyThreshold and _numpy() is not None
+
     def _calcPaths(self):
-        if self._graphCalculated: return
-        # copy latest copy of candidates from ballot, weakest and strongest may have already been dropped
-        c = self._ballot._candidates.copy()
-        graph = Ballot()
-        if self.verbose: print("\tNullifying weak pairwise preferences...")
-        for i in c:
-            for j in c:
-                if i != j:
-                    if self._ballot.get(i, j) > self._ballot.get(j, i):
-                        graph._set(i, j, self._ballot.get(i, j))
-                    else:
-                        graph._set(i, j, 0)
-        del self._ballot  # original copied ballot no longer required
+        """Split the core into strongly connected components and find the strongest paths inside each
 
-        count = 0
-        now = datetime.datetime.now()
-        lastT = now
-        numC = len(c)
-        if self.verbose:
-            print("\tCalculating strongest paths...")
-            print("\tCandidates evaluated...")
-            print('\t\t', count, '\t', now.strftime("%Y-%m-%d %H:%M:%S"), sep='')
-        for i in c:
-            if self.verbose and count and count % 10 == 0:
-                print('\t\t', count, '\t', now.strftime("%Y-%m-%d %H:%M:%S"), sep='', end='')
-                now = datetime.datetime.now()
-                estCompletion = (now - lastT) * (numC - count) / 10 + now
-                print('\t', 'est finish: ', estCompletion.strftime("%Y-%m-%d %H:%M"), sep='')
-                lastT = now
-            count += 1
-
-            # Using Floyd–Warshall algorithm for strongest path
-            for j in c:
-                if i != j:
-                    for k in c:
-                        if i != k and j != k:
-                            graph._set(j, k, \
-                                       max(graph.get(j, k), \
-                                           min(graph.get(j, i), \
-                                               graph.get(i, k))))
-        self._graphCalculated = True
-        self._graph = graph
+Components are those of the pairwise majority graph, found with Tarjan's algorithm. No strongest
+path leaves a component and comes back, so Floyd–Warshall only runs inside nontrivial components.
+"""
+        if self._components is not None: return
+        start = self._startPhase()
+        t = self._tally._tally
+        n = len(self._tally._candidates)
+        self._componentPaths = []
+        for members in self._splitComponents():
+            if members is None:
+                self._componentPaths.append(None)
+            elif self._paths is not None:
+                # Paths never leave a component, so the full matrix restricted to it is exact.
+                self._componentPaths.append(_pack(self._paths[i * n + j] for i in members for j in members))
+            else:
+                self._componentPaths.append(
+                    self._strongestPaths(_pack(t[i * n + j] for i in members for j in members), len(members)))
+        self._endPhase('paths', start, len(self._core))
         return
 
+    def _splitComponents(self):
+        """Find the strongly connected components of the core
+
+Return the tally positions of the members of each component, or None for single candidates.
+"""
+        t = self._tally._tally
+        n = len(self._tally._candidates)
+        core = self._core
+        succ = [[b for b, j in enumerate(core) if t[i * n + j] > t[j * n + i]] for i in core]
+        self._successors = succ
+        self._components = _tarjan(succ)
+        if self._monitors:
+            self._emit('components', count=len(self._components), largest=max(len(c) for c in self._components))
+        return [[core[a] for a in component] if len(component) > 1 else None for component in self._components]
+
+    def _strongestPaths(self, t, numC):
+        """Return the strongest path matrix for a flat, row-major numC x numC pairwise tally t"""
+        useNumpy = self._useNumpy(numC)
+        if useNumpy:
+            np = _np
+            d = _asNumpy(t, numC)
+            paths = np.where(d > d.T, d, 0)
+        else:
+            paths = [t[i * numC + j] if t[i * numC + j] > t[j * numC + i] else 0
+                     for i in range(numC) for j in range(numC)]
+        compact = isinstance(t, array)  # only compact counts can be shared as a 64-bit matrix
+        del t
+
+        workers = min(self.workers, numC)
+        pool = None
+        if workers > 1 and compact and numC > self.parallelThreshold:
+            pool = _PathPool(paths, numC, workers, useNumpy)
+
+        monitors = self._monitors
+        began = time.perf_counter() if monitors else None
+        pairs = (numC - 1) * (numC - 2)  # pairs relaxed per pivot
+        try:
+            for i in range(numC):
+                if monitors:
+                    elapsed = time.perf_counter() - began
+                    rate = i * pairs / elapsed if elapsed else 0.0
+                    self._emit('pivot', done=i, total=numC, pairs=i * pairs, pairs_per_second=rate,
+                               eta=elapsed / i * (numC - i) if i else 0.0)
+
+                # Using Floyd–Warshall algorithm for strongest path
+                if pool:
+                    pool.step(i)
+                elif useNumpy:
+                    _relaxNumpy(paths, i)
+                else:
+                    _relaxPython(paths, numC, i)
+            if pool:
+                paths = pool.result()
+            if monitors:
+                elapsed = time.perf_counter() - began
+                self._emit('pivot', done=numC, total=numC, pairs=numC * pairs,
+                           pairs_per_second=numC * pairs / elapsed if elapsed else 0.0, eta=0.0)
+        finally:
+            if pool:
+                pool.close()
+        if useNumpy:
+            np.fill_diagonal(paths, 0)
+            paths = paths.ravel().tolist()
+        return _pack(paths)
+
     def _calcRankings(self):
         """
         Determine rankings based on the strongest path matrix.
+
+        A candidate beats every candidate in the components its own component reaches, and inside
+        a component the strongest paths decide. Candidates are ranked by the longest chain of
+        candidates they beat, which is the order in which repeatedly removing the weakest
+        candidates (those who beat nobody left) would take them off the graph.
         """
-        if not self._graphCalculated: self._calcPaths()
-        candidates = self._graph._candidates.copy()
-
-        while len(candidates) > 0:
-            # find and remove weakest candidates. If tied, remove all tied candidates.
-            weakest = []
-            for c in candidates:
-                remove = True
-                for challenger in candidates:
-                    if c != challenger:
-                        if self._graph.get(c, challenger) > self._graph.get(challenger, c):
-                            remove = False
-                            break
-                if remove: weakest.append(c)
-            # Sanity check, something must be removed with each iteration
-            if len(weakest) < 1: raise RuntimeError('Unable to find weakest candidate.')
-            # push weakest on top of ladder and remove from graph
-            for c in weakest: self._graph.remove(c)
+        if self._graphCalculated: return
+        self._calcPaths()
+        start = self._startPhase()
+        core = self._core
+        componentOf = [0] * len(core)
+        for c, component in enumerate(self._components):
+            for a in component:
+                componentOf[a] = c
+
+        level = [0] * len(core)
+        highest = []  # highest level within each component
+        # Tarjan yields sinks first, so every component reached from this one is already levelled
+        for c, component in enumerate(self._components):
+            reached = {componentOf[b] for a in component for b in self._successors[a]} - {c}
+            base = max((highest[d] + 1 for d in reached), default=0)
+            local = self._componentLevels(self._componentPaths[c], len(component))
+            for a, l in zip(component, local):
+                level[a] = base + l
+            highest.append(max(level[a] for a in component))
+        self._placeLevels(level)
+        self._endPhase('rankings', start, len(core))
+        return
+
+    def _placeLevels(self, level):
+        """Put the core on the ladder, above the pruned losers, by the level of each core candidate"""
+        names = self._tally._candidates
+        core = self._core
+        byLevel = {}
+        for a in range(len(core)):
+            byLevel.setdefault(level[a], []).append(names[core[a]])
+        # push weakest on top of ladder
+        for l in sorted(byLevel):
+            weakest = byLevel[l]
             if len(weakest) == 1: weakest = weakest[0]
             self._ladder.insert(0, weakest)
-            candidates = self._graph._candidates.copy()  # refresh list
-        del self._graph
+        self._graphCalculated = True
         return
 
+    @staticmethod
+    def _componentLevels(paths, k):
+        """Level each candidate of a component: 0 if it beats nobody, else one above the highest it beats"""
+        if paths is None:
+            return [0]
+        beatenBy = [[] for a in range(k)]
+        wins = [0] * k
+        for a in range(k):
+            for b in range(k):
+                if a != b and paths[a * k + b] > paths[b * k + a]:
+                    wins[a] += 1
+                    beatenBy[b].append(a)
+        level = [0] * k
+        weakest = [a for a in range(k) if not wins[a]]
+        # Sanity check, something must be removed with each iteration
+        if not weakest: raise RuntimeError('Unable to find weakest candidate.')
+        l = 0
+        while weakest:
+            nextLayer = []
+            for b in weakest:
+                level[b] = l
+                for a in beatenBy[b]:
+                    wins[a] -= 1
+                    if not wins[a]:
+                        nextLayer.append(a)
+            weakest = nextLayer
+            l += 1
+        if len([a for a in range(k) if wins[a]]):
+            raise RuntimeError('Unable to find weakest candidate.')
+        return level
+
     def print_ladder(self):
         rank = 1
         for c in self.ladder():
@@ -309,156 +2005,209 @@ Ties are returned as lists within the ladder.
             rank += 1
         return
 
+    @classmethod
+    def ladders(cls, ballots, kernel='auto', workers=1):
+        """Rank many independent tallies in one call and return their ladders, in order.
 
-# unit test cases
-if __name__ == '__main__':
+Every tally is pruned on its own. The strongest path step then runs once per component size for a
+whole batch of tallies, with the cores of every tally stacked into one NumPy kernel
+(see _stackPaths). With workers > 1 the tallies are shared out between that many processes.
+"""
+        if workers > 1:
+            ballots = list(ballots)
+            return cls._inPool(_batchLadders, [(chunk, kernel) for chunk in cls._chunks(ballots, workers)], workers)
+        result = []
+        graphs = []
+        for ballot in ballots:
+            graphs.append(cls(ballot, False, kernel))
+            if len(graphs) == cls.batchSize:
+                cls._stackPaths(graphs)
+                result.extend(g.ladder() for g in graphs)
+                graphs = []
+        cls._stackPaths(graphs)
+        result.extend(g.ladder() for g in graphs)
+        return result
+
+    @classmethod
+    def subsetLadders(cls, ballot, subsets, kernel='auto', workers=1):
+        """Rank one tally restricted to each of many candidate subsets. Return one ladder per subset.
+
+Keyword arguments:
+subsets -- iterables of candidate names. Every other candidate is treated as withdrawn.
+
+Each subset's sub-matrix is gathered straight from the one tally, which is neither copied nor
+changed per subset. See ladders() for the batched path step and workers.
+"""
+        if isinstance(ballot, SparseBallot):
+            ballot = ballot.dense()
+        index = ballot._index
+        keeps = [sorted({index[c.casefold()] for c in subset}) for subset in subsets]
+        if workers > 1:
+            return cls._inPool(_batchSubsets, [(ballot, chunk, kernel) for chunk in cls._chunks(keeps, workers)],
+                               workers)
+        return cls.ladders((ballot._subset(keep) for keep in keeps), kernel)
 
-    # assignment test
-    t1 = Ballot('abcd')
-    if t1.get('a', 'c') != 1 or t1.get('d', 'b') != 0:
-        raise NotImplementedError('__init__ failed')
-    del t1
-
-    # Equality tests
-    t1 = Ballot('abcd')
-    t2 = Ballot('abcd')
-    if t1 == t2:
-        pass
-    else:
-        raise NotImplementedError('Equality method failed')
-    t3 = Ballot('dcba')
-    if t1 == t3:
-        raise NotImplementedError('Equality method failed')
-    if t1 != t3:
-        pass
-    else:
-        raise NotImplementedError('Inequality method failed')
-    del t1, t2, t3
-
-    # duplication test
-    t1 = Ballot('abcd')
-    t2 = t1.copy()
-    if (t1 is t2) or (t1 != t2):
-        raise NotImplementedError('Copy failed')
-    del t1, t2
-
-    # deletion test
-    t1 = Ballot('abcd')
-    t1.remove('c')
-    if t1 != Ballot('abd'):
-        raise NotImplementedError('Remove method failed')
-    del t1
-
-    # addition and multiplication tests
-    t1 = Ballot('abcd')
-    t2 = Ballot('abcd')
-    if t1 * 4 != t2 + t2 + t2 + t2:
-        raise NotImplementedError('Addition and/or multiplication methods failed')
-    del t1, t2
-
-    # extend and popLosers tests
-    t1 = Ballot('abcd')
-    t1.extend('XYZ')
-    if set('xyz') != set(t1.popLosers()):
-        raise NotImplementedError('popLosers and/or extend method failed')
-    del t1
-
-    # Graph creation tests
-    t1 = Ballot('abcd')
-    g = Graph(t1, False)
-    if g._ladder != list('abcd'):
-        raise NotImplementedError('Simple graph creation failed')
-
-    t2 = Ballot('ab')
-    t2.extend('cd')
-    t2.extend('e')
-    t2.extend('fg')
-    g2 = Graph(t2, False)
-    if g2._ladder[:2] != ['a', 'b'] or set(g2._ladder[2]) != set(['c', 'd']):
-        raise NotImplementedError('Tied graph creation failed')
-    del t1, g, t2, g2
-
-    # Ranking tests
-    t = Ballot('abcd')
-    g = Graph(t, False)
-    if g.ladder() != ('a', 'b', 'c', 'd'):
-        raise NotImplementedError('Simple graph ranking failed')
-    del t, g
-
-    # Path tests
-    test = 5 * Ballot('ACBED') + 5 * Ballot('ADECB') + \
-           8 * Ballot('BEDAC') + 3 * Ballot('CABED') + 7 * Ballot('CAEBD') + \
-           2 * Ballot('CBADE') + 7 * Ballot('DCEBA') + 8 * Ballot('EBADC')
-    graph = Graph(test, False)
-    r = graph.ladder()
-    if r != ('e', 'a', 'c', 'b', 'd'):
-        raise NotImplementedError('ranking algorithm failed')
-    del test, graph, r
-
-    # path with tie
-    A = Ballot('abcd')
-    B = Ballot('dabc')
-    C = Ballot('cdab')
-    T = A + B + C
-    g = Graph(T, False)
-    if g.ladder()[0] != 'a' and set(g.ladder()[1]) != set('bcd'): raise NotImplementedError(
-        'ranking algorithm with tie failed')
-    del A, B, C, T, g
-
-    # popWinner test
-    A = Ballot('abcd')
-    T = [A.popWinner()]
-    T.append(A.popWinner())
-    T.append(A.popWinner())
-    T.append(A.popWinner())
-    if T != ['a', 'b', 'c', 'd']: raise NotImplementedError('popWinner failed')
-    del T, A
-
-    # popWinner test 2
-    A = Ballot('ABCD') * 10
-    B = Ballot('Acdb') * 9
-    C = Ballot('Adbc') * 8
-    T = A + B + C
-    r = []
-    r.append(T.popWinner())
-    r.append(T.popWinner())
-    if r != ['a', None]: raise NotImplementedError('popWinner failed')
-    del T, A, r
-
-    # 3-way Condorcet tie with obvious winners and losers
-    A = Ballot('azBCDe') * 10
-    B = Ballot('azcdbe') * 9
-    C = Ballot('azdbce') * 8
-    T = A + B + C
-    g = Graph(T, False)
-    if g.ladder() != ('a', 'z', 'b', 'c', 'd', 'e'): raise NotImplementedError('condorcet tie failed')
-    del A, B, C, T, g
-
-    # 3-way Condorcet tie with no obvious winner or losers
-    A = Ballot('BCD') * 10
-    B = Ballot('cdb') * 9
-    C = Ballot('dbc') * 8
-    T = A + B + C
-    g = Graph(T, False)
-    if g.ladder() != ('b', 'c', 'd'): raise NotImplementedError('condorcet tie failed')
-    del A, B, C, T, g
-
-    # Theoretical United States presidential election, 2000
-    print('\n== United States presidential election, 2000 ==')
-    republican = ['Bush', 'Buchanan', 'Browne', 'Gore', 'Nader']
-    democrat = ['Gore', 'Nader', 'Browne', 'Bush', 'Buchanan']
-    green = ['Nader', 'Browne', 'Gore', 'Bush', 'Buchanan']
-    reform = ['Buchanan', 'Bush', 'Gore', 'Browne', 'Nader']
-    libertarian = ['Browne', 'Nader', 'Gore', 'Bush', 'Buchanan']
-
-    repBallot = Ballot(republican) * 50456002
-    demBallot = Ballot(democrat) * 50999897
-    greenBallot = Ballot(green) * 2882955
-    reformBallot = Ballot(reform) * 448895
-    libBallot = Ballot(libertarian) * 384431
-
-    total = repBallot + demBallot + greenBallot + reformBallot + libBallot
-    total.printReport()
-
-    g = Graph(total)
-    g.print_ladder()
+    @classmethod
+    def withdrawalLadders(cls, ballot, candidates=None, kernel='auto', workers=1):
+        """Return {candidate: ladder of the tally with that candidate withdrawn} for candidates (default all)"""
+        names = list(ballot._candidates)
+        withdrawn = names if candidates is None else [c.casefold() for c in candidates]
+        ladders = cls.subsetLadders(ballot, ([c for c in names if c != w] for w in withdrawn), kernel, workers)
+        return dict(zip(withdrawn, ladders))
+
+    @staticmethod
+    def _chunks(items, count):
+        """Split a list into at most count contiguous, nearly equal chunks"""
+        count = max(1, min(count, len(items)))
+        bounds = [len(items) * c // count for c in range(count + 1)]
+        return [items[bounds[c]:bounds[c + 1]] for c in range(count)]
+
+    @staticmethod
+    def _inPool(function, jobs, workers):
+        """Run function(*job) for every job in a pool of worker processes and join the returned lists"""
+        if len(jobs) < 2:
+            return [x for job in jobs for x in function(*job)]
+        import multiprocessing
+        with multiprocessing.Pool(min(workers, len(jobs))) as pool:
+            return [x for part in pool.starmap(function, jobs) for x in part]
+
+    @classmethod
+    def _stackPaths(cls, graphs):
+        """Rank the cores of many graphs at once
+
+Cores of equal size from all the graphs are gathered from their tallies into one B x k x k array,
+relaxed together by _relaxStacked and levelled together by _stackedLevels. A candidate beats every
+component its own reaches, so strongest paths over a whole core level it exactly as the component
+by component step of _calcRankings does. Graphs the stack cannot take (the 'python' kernel, exact
+Python counts or paths kept by update()) rank themselves.
+"""
+        bySize = {}
+        for g in graphs:
+            if g._graphCalculated:
+                continue
+            if g.kernel == 'python' or g._paths is not None or not isinstance(g._tally._tally, array) or \
+                    len(g._core) < 2 or _numpy() is None:
+                g._calcRankings()
+                continue
+            bySize.setdefault(len(g._core), []).append(g)
+        np = _np
+        for k, group in bySize.items():
+            step = max(1, (1 << 22) // (k * k))  # bound the temporaries of one stacked pivot
+            for first in range(0, len(group), step):
+                chunk = group[first:first + step]
+                d = np.stack([_asNumpy(g._tally._tally, len(g._tally._candidates))[np.ix_(g._core, g._core)]
+                              for g in chunk])
+                p = np.where(d > d.transpose(0, 2, 1), d, 0)
+                del d
+                _relaxStacked(p)
+                for g, level in zip(chunk, _stackedLevels(p > p.transpose(0, 2, 1)).tolist()):
+                    g._placeLevels(level)
+        return
+
+
+def _bootstrapWorker(bootstrap, seed, resamples, noise, kernel):
+    """Internal function. Worker process body of Bootstrap.run()."""
+    return bootstrap._places(_np.random.default_rng(seed), resamples, noise, kernel)
+
+
+class Bootstrap(object):
+    """Robustness of a Schulze ranking under resampled ballots and perturbed margins. Requires NumPy.
+
+A resample draws as many voters as the poll has, with replacement, from its distinct rankings: one
+multinomial draw gives the weight of every ranking. The pairwise matrices of a whole batch of resamples
+are then one matrix product of those weights with the pairwise votes of each ranking, and the batch is
+ranked by Graph.ladders(), which relaxes the strongest paths of every resample in one stacked kernel.
+"""
+    batchSize = 256  # Resamples drawn and multiplied at once
+
+    def __init__(self, rankings, candidates=None):
+        """
+Keyword arguments:
+rankings -- iterable of rankings (most preferred first), or a mapping of ranking -> number of voters.
+            See Ballot.addRanking() for ties and truncated rankings.
+candidates -- full candidate list. Required when rankings may leave candidates out.
+"""
+        np = _numpy()
+        if np is None:
+            raise ImportError('Bootstrap requires NumPy')
+        counts = Counter()
+        if hasattr(rankings, 'items'):
+            for ranking, weight in rankings.items():
+                counts[_rankingGroups(ranking)] += weight
+        else:
+            counts.update(_rankingGroups(ranking) for ranking in rankings)
+        counts = {ranking: weight for ranking, weight in counts.items() if weight}
+        total = Ballot.fromRankings(counts, candidates)
+        self.candidates = tuple(total._candidates)
+        self.ladder = Graph(total, verbose=False).ladder()  # ranking of the poll itself
+        self._voters = round(sum(counts.values()))
+        if self._voters < 1:
+            raise ValueError('Need at least one voter')
+        votes = []
+        for ranking in counts:
+            single = Ballot._blank(self.candidates)
+            single.addRanking(ranking)
+            votes.append(single._tally)
+        self._votes = np.array(votes, dtype=np.float64).reshape(len(votes), len(self.candidates) ** 2)
+        weights = np.array([float(w) for w in counts.values()])
+        self._p = weights / weights.sum()
+        return
+
+    def run(self, resamples=1000, seed=None, noise=0, workers=1, kernel='auto'):
+        """Rank resamples of the poll. Return {candidate: probability of finishing in each place}.
+
+Keyword arguments:
+resamples -- number of resamples
+seed -- seed for numpy.random.default_rng(). The same seed and workers always draw the same resamples.
+noise -- standard deviation, in votes, of normal noise added to every margin of every resample
+workers -- number of processes sharing the resamples
+kernel -- strongest path kernel, as for Graph
+
+Place probabilities are listed first place first. Tied candidates all take the best place of their tie.
+"""
+        np = _np
+        if workers > 1 and resamples > 1:
+            import multiprocessing
+            workers = min(workers, resamples)
+            seeds = np.random.SeedSequence(seed).spawn(workers)
+            shares = [resamples * w // workers for w in range(workers + 1)]
+            with multiprocessing.Pool(workers) as pool:
+                places = sum(pool.starmap(_bootstrapWorker, [(self, seeds[w], shares[w + 1] - shares[w], noise, kernel)
+                                                             for w in range(workers)]))
+        else:
+            places = self._places(np.random.default_rng(seed), resamples, noise, kernel)
+        return {c: tuple((row / max(resamples, 1)).tolist()) for c, row in zip(self.candidates, places)}
+
+    def _places(self, rng, resamples, noise, kernel):
+        """Rank resamples drawn from rng. Return an n x n array counting how often each candidate took each place."""
+        np = _np
+        n = len(self.candidates)
+        index = {c: i for i, c in enumerate(self.candidates)}
+        places = np.zeros((n, n), dtype=np.int64)
+        for first in range(0, resamples, self.batchSize):
+            size = min(self.batchSize, resamples - first)
+            draws = rng.multinomial(self._voters, self._p, size=size)
+            if self._voters < 1 << 53:
+                tallies = np.rint(draws @ self._votes).astype(np.int64)  # exact in floating point
+            else:
+                tallies = draws @ self._votes.astype(np.int64)
+            if noise:
+                # e is added to one side of each pair and taken from the other, moving the margin by 2e
+                e = np.triu(rng.normal(0.0, noise / 2, (size, n, n)), 1)
+                e = np.rint(e - e.transpose(0, 2, 1)).astype(np.int64).reshape(size, n * n)
+                tallies = np.maximum(tallies + e, 0)
+            ballots = (Ballot._fromTally(self.candidates, array('q', row.tobytes())) for row in tallies)
+            for ladder in Graph.ladders(ballots, kernel):
+                place = 0
+                for entry in ladder:
+                    group = (entry,) if isinstance(entry, str) else entry
+                    for c in group:
+                        places[index[c], place] += 1
+                    place += len(group)
+        return places
+
+
+# unit test cases live in SchulzeTest.py, out of the import path
+if __name__ == '__main__':
+    import SchulzeTest
+    SchulzeTest.main()
@@ -0,0 +1,421 @@
+"""Self-tests of Schulze.py. Run with: python SchulzeTest.py"""
+import os
+from array import array
+from Schulze import Ballot, Bootstrap, Graph, RankingCache, SparseBallot, WeightedBallots, _numpy
+
+
+def main():
+    # assignment test
+    t1 = Ballot('abcd')
+    if t1.get('a', 'c') != 1 or t1.get('d', 'b') != 0:
+        raise NotImplementedError('__init__ failed')
+    del t1
+
+    # Equality tests
+    t1 = Ballot('abcd')
+    t2 = Ballot('abcd')
+    if t1 == t2:
+        pass
+    else:
+        raise NotImplementedError('Equality method failed')
+    t3 = Ballot('dcba')
+    if t1 == t3:
+        raise NotImplementedError('Equality method failed')
+    if t1 != t3:
+        pass
+    else:
+        raise NotImplementedError('Inequality method failed')
+    del t1, t2, t3
+
+    # duplication test
+    t1 = Ballot('abcd')
+    t2 = t1.copy()
+    if (t1 is t2) or (t1 != t2):
+        raise NotImplementedError('Copy failed')
+    del t1, t2
+
+    # deletion test
+    t1 = Ballot('abcd')
+    t1.remove('c')
+    if t1 != Ballot('abd'):
+        raise NotImplementedError('Remove method failed')
+    del t1
+
+    # addition and multiplication tests
+    t1 = Ballot('abcd')
+    t2 = Ballot('abcd')
+    if t1 * 4 != t2 + t2 + t2 + t2:
+        raise NotImplementedError('Addition and/or multiplication methods failed')
+    del t1, t2
+
+    # addition with candidates listed in a different order
+    t1 = Ballot('abcd') + Ballot('dcba')
+    if t1.get('a', 'd') != 1 or t1.get('d', 'a') != 1 or t1 != Ballot('dcba') + Ballot('abcd'):
+        raise NotImplementedError('Addition of reordered ballots failed')
+    del t1
+
+    # in place ranking accumulation
+    t1 = Ballot()
+    t1.addRanking('abcd', 3)
+    t1.addRanking('DCBA')
+    if t1 != Ballot('abcd') * 3 + Ballot('dcba'):
+        raise NotImplementedError('addRanking failed')
+    t1.addRanking('abcd', 2 ** 64)
+    if t1.get('a', 'b') != 3 + 2 ** 64:
+        raise NotImplementedError('addRanking overflow failed')
+    del t1
+
+    # compact counts: the narrowest width that holds them, widened as they grow, exact past 64 bits
+    t1 = Ballot('abcd')
+    widths = [t1._tally.typecode]
+    t1.addRanking('abcd', 200)
+    widths.append(t1._tally.typecode)
+    t1 = t1 * 2 ** 40
+    widths.append(t1._tally.typecode)
+    t1 = t1 + t1 * 2 ** 30
+    if widths != ['b', 'h', 'q'] or isinstance(t1._tally, array) or t1.get('a', 'b') != 201 * 2 ** 40 * (1 + 2 ** 30):
+        raise NotImplementedError('Compact tally widening failed')
+    t1 = Ballot._blank('abcd')
+    t1.reserve(50000)
+    t1.addRanking('abcd', 3)
+    if t1._tally.typecode != 'i' or t1.fingerprint() != (Ballot('abcd') * 3).fingerprint():
+        raise NotImplementedError('Reserved tally width failed')
+    W = WeightedBallots('abc')
+    W.cast('v', 'abc', 2 ** 70)
+    W.cast('w', 'cab', 2)
+    W.retract('v')
+    t1 = Ballot._blank('abc')
+    t1.addRanking('cab', 2)
+    t1 = Ballot._fromTally(t1.candidates(), list(t1._tally))
+    t2 = W.tally()
+    if t1.fingerprint() != t2.fingerprint() or not isinstance(t2._tally, array):
+        raise NotImplementedError('Compact tally repacking failed')
+    del t1, t2, widths, W
+
+    # distinct ranking aggregation
+    t1 = Ballot.fromRankings(['abc', 'ABC', 'cba', 'abc'])
+    t2 = Ballot.fromRankings({'abc': 3, 'cba': 1})
+    if t1 != Ballot('abc') * 3 + Ballot('cba') or t1 != t2:
+        raise NotImplementedError('fromRankings failed')
+    del t1, t2
+
+    # serialization round trip, exact fractions included
+    import io
+    from fractions import Fraction
+    sparse = SparseBallot._blank('abcd')
+    sparse.addRanking('ba', Fraction(2, 3))
+    sparse.extend('e', Fraction(1, 7))
+    for t1 in (Ballot('abcd') * 7, Ballot('abc') * 2 ** 70, Ballot(), Ballot('abc') * Fraction(5, 3), sparse):
+        buf = io.BytesIO()
+        t1.dump(buf)
+        buf.seek(0)
+        t2 = Ballot.load(buf)
+        pairs = [(a, b) for a in t1.candidates() for b in t1.candidates() if a != b]
+        if t2 != t1 or type(t2) is not type(t1) or any(t2.get(*pair) != t1.get(*pair) for pair in pairs):
+            raise NotImplementedError('dump/load failed')
+    del t1, t2, buf, sparse, pairs
+
+    # ties and truncated rankings
+    t1 = Ballot(['a', ('b', 'c'), 'd'])
+    if t1.get('a', 'b') != 1 or t1.get('b', 'c') != 0 or t1.get('c', 'b') != 0 or t1.get('c', 'd') != 1:
+        raise NotImplementedError('Ballot with ties failed')
+    t2 = Ballot('abcde')
+    t2.addRanking(['b', ['a', 'd']], 2)
+    expected = {('b', 'a'): 2, ('a', 'd'): 1, ('d', 'a'): 0, ('a', 'c'): 3, ('d', 'e'): 3, ('c', 'e'): 1, ('e', 'c'): 0}
+    if any(t2.get(*pair) != votes for pair, votes in expected.items()):
+        raise NotImplementedError('addRanking with ties and truncation failed')
+    t1 = Ballot.fromRankings({('b', ('a', 'd')): 2}, candidates='abcde') + Ballot('abcde')
+    if t1 != t2:
+        raise NotImplementedError('fromRankings with ties and truncation failed')
+    del t1, t2, expected
+
+    # extend and popLosers tests
+    t1 = Ballot('abcd')
+    t1.extend('XYZ')
+    if set('xyz') != set(t1.popLosers()):
+        raise NotImplementedError('popLosers and/or extend method failed')
+    del t1
+
+    # Graph creation tests
+    t1 = Ballot('abcd')
+    g = Graph(t1, False)
+    if g._ladder != list('abcd'):
+        raise NotImplementedError('Simple graph creation failed')
+
+    t2 = Ballot('ab')
+    t2.extend('cd')
+    t2.extend('e')
+    t2.extend('fg')
+    g2 = Graph(t2, False)
+    if g2._ladder[:2] != ['a', 'b'] or set(g2._ladder[2]) != set(['c', 'd']):
+        raise NotImplementedError('Tied graph creation failed')
+    del t1, g, t2, g2
+
+    # Ranking tests
+    t = Ballot('abcd')
+    g = Graph(t, False)
+    if g.ladder() != ('a', 'b', 'c', 'd'):
+        raise NotImplementedError('Simple graph ranking failed')
+    del t, g
+
+    # Path tests
+    test = 5 * Ballot('ACBED') + 5 * Ballot('ADECB') + \
+           8 * Ballot('BEDAC') + 3 * Ballot('CABED') + 7 * Ballot('CAEBD') + \
+           2 * Ballot('CBADE') + 7 * Ballot('DCEBA') + 8 * Ballot('EBADC')
+    graph = Graph(test, False)
+    r = graph.ladder()
+    if r != ('e', 'a', 'c', 'b', 'd'):
+        raise NotImplementedError('ranking algorithm failed')
+    del test, graph, r
+
+    # path with tie
+    A = Ballot('abcd')
+    B = Ballot('dabc')
+    C = Ballot('cdab')
+    T = A + B + C
+    g = Graph(T, False)
+    if g.ladder()[0] != 'a' and set(g.ladder()[1]) != set('bcd'): raise NotImplementedError(
+        'ranking algorithm with tie failed')
+    del A, B, C, T, g
+
+    # popWinner test
+    A = Ballot('abcd')
+    T = [A.popWinner()]
+    T.append(A.popWinner())
+    T.append(A.popWinner())
+    T.append(A.popWinner())
+    if T != ['a', 'b', 'c', 'd']: raise NotImplementedError('popWinner failed')
+    del T, A
+
+    # popWinner test 2
+    A = Ballot('ABCD') * 10
+    B = Ballot('Acdb') * 9
+    C = Ballot('Adbc') * 8
+    T = A + B + C
+    r = []
+    r.append(T.popWinner())
+    r.append(T.popWinner())
+    if r != ['a', None]: raise NotImplementedError('popWinner failed')
+    del T, A, r
+
+    # 3-way Condorcet tie with obvious winners and losers
+    A = Ballot('azBCDe') * 10
+    B = Ballot('azcdbe') * 9
+    C = Ballot('azdbce') * 8
+    T = A + B + C
+    g = Graph(T, False)
+    if g.ladder() != ('a', 'z', 'b', 'c', 'd', 'e'): raise NotImplementedError('condorcet tie failed')
+    del A, B, C, T, g
+
+    # 3-way Condorcet tie with no obvious winner or losers
+    A = Ballot('BCD') * 10
+    B = Ballot('cdb') * 9
+    C = Ballot('dbc') * 8
+    T = A + B + C
+    g = Graph(T, False)
+    if g.ladder() != ('b', 'c', 'd'): raise NotImplementedError('condorcet tie failed')
+    del A, B, C, T, g
+
+    # Strongest path kernels must agree
+    if _numpy() is not None:
+        fixtures = [Ballot('abcd'),
+                    5 * Ballot('ACBED') + 5 * Ballot('ADECB') + 8 * Ballot('BEDAC') + 3 * Ballot('CABED') +
+                    7 * Ballot('CAEBD') + 2 * Ballot('CBADE') + 7 * Ballot('DCEBA') + 8 * Ballot('EBADC'),
+                    Ballot('abcd') + Ballot('dabc') + Ballot('cdab'),
+                    Ballot('azBCDe') * 10 + Ballot('azcdbe') * 9 + Ballot('azdbce') * 8,
+                    Ballot('BCD') * 10 + Ballot('cdb') * 9 + Ballot('dbc') * 8,
+                    Ballot('BCD') * 10 + Ballot('cdb') * 10 + Ballot('dbc') * 10,
+                    Ballot('abc') * 2 ** 70 + Ballot('bca') * 2 ** 69 + Ballot('cab') * 2 ** 68]
+        for T in fixtures:
+            if Graph(T, False, kernel='python').ladder() != Graph(T, False, kernel='numpy').ladder():
+                raise NotImplementedError('numpy kernel disagrees with python kernel')
+
+    # Parallel strongest paths must match the serial run, and the worker pool must actually run
+    import random
+    import Schulze
+    pools = []
+
+    class CountedPool(Schulze._PathPool):
+        def __init__(self, *args):
+            pools.append(args[1])
+            super().__init__(*args)
+
+    rng = random.Random(58)
+    names = ['c{}'.format(i) for i in range(40)]
+    large = Ballot._blank(names)
+    for b in range(200):
+        large.addRanking(rng.sample(names, len(names)))
+    fixtures = [Ballot('BCD') * 10 + Ballot('cdb') * 9 + Ballot('dbc') * 8,
+                5 * Ballot('ACBED') + 5 * Ballot('ADECB') + 8 * Ballot('BEDAC') + 3 * Ballot('CABED') +
+                7 * Ballot('CAEBD') + 2 * Ballot('CBADE') + 7 * Ballot('DCEBA') + 8 * Ballot('EBADC'), large]
+    Schulze._PathPool = CountedPool
+    try:
+        for T in fixtures:
+            for kernel in ('python', 'numpy') if _numpy() is not None else ('python',):
+                serial, parallel = Graph(T, False, kernel=kernel), Graph(T, False, kernel=kernel, workers=2)
+                parallel.parallelThreshold = 2
+                started = len(pools)
+                if serial.ladder() != parallel.ladder() or len(pools) == started:
+                    raise NotImplementedError('parallel strongest paths disagree with serial run')
+                if any(serial.strength(a, b) != parallel.strength(a, b) for a in T.candidates() for b in T.candidates()):
+                    raise NotImplementedError('parallel path strengths disagree with serial run')
+        started = len(pools)
+        Graph(fixtures[1], False, workers=2).ladder()  # below parallelThreshold
+        if len(pools) != started or Graph(large, False, workers=2).ladder() != serial.ladder() or len(pools) == started:
+            raise NotImplementedError('Worker pool threshold failed')
+    finally:
+        Schulze._PathPool = CountedPool.__bases__[0]
+    del fixtures, T, large, names, pools, serial, parallel, started
+
+    # Incremental path updates must match a full recompute
+    import random
+    rng = random.Random(2000)
+    names = 'abcdefgh'
+    T = Ballot(names) * 3 + Ballot('hgfedcba') * 2 + Ballot('cdefghab') * 2
+    g = Graph(T, False)
+    g.ladder()
+    for step in range(40):
+        if step % 4:
+            a, b = rng.sample(names, 2)
+            change = {(a, b): max(0, T.get(a, b) + rng.randint(-2, 3))}
+            T._set(a, b, change[(a, b)])
+        else:
+            order = rng.sample(names, len(names))
+            change = Ballot(order)
+            T = T + change
+        g.update(change)
+        if g.ladder() != Graph(T, False).ladder():
+            raise NotImplementedError('incremental path update failed')
+    del rng, names, T, g, step, a, b, change, order
+
+    # Sparse tally must match the dense one, pair by pair and in the ranking
+    rng = random.Random(13)
+    names = ['w{}'.format(i) for i in range(60)]
+    dense, sparse = Ballot._blank(names), SparseBallot._blank(names)
+    for b in range(300):
+        ranking = rng.sample(names[:rng.choice((10, 60))], rng.randrange(1, 5))
+        if rng.random() < 0.2:
+            ranking[-2:] = [ranking[-2:]]
+        dense.addRanking(ranking)
+        sparse.addRanking(ranking)
+    if sparse != dense or sparse.get('w0', 'w59') != dense.get('w0', 'w59'):
+        raise NotImplementedError('Sparse tally failed')
+    dense.extend('xy', 2)
+    sparse.extend('xy', 2)
+    if sparse != dense or sparse * 2 + sparse != dense * 3:
+        raise NotImplementedError('Sparse extend or arithmetic failed')
+    if Graph(sparse, False).ladder() != Graph(dense, False).ladder():
+        raise NotImplementedError('Sparse ranking failed')
+    del rng, names, dense, sparse, ranking
+
+    # Path queries over every candidate
+    test = 5 * Ballot('ACBED') + 5 * Ballot('ADECB') + \
+           8 * Ballot('BEDAC') + 3 * Ballot('CABED') + 7 * Ballot('CAEBD') + \
+           2 * Ballot('CBADE') + 7 * Ballot('DCEBA') + 8 * Ballot('EBADC')
+    graph = Graph(test, False)
+    expected = {'a': (0, 28, 28, 30, 24), 'b': (25, 0, 28, 33, 24), 'c': (25, 29, 0, 29, 24),
+                'd': (25, 28, 28, 0, 24), 'e': (25, 28, 28, 31, 0)}
+    if any(graph.strength(a, b) != s for a, row in expected.items() for b, s in zip('abcde', row)):
+        raise NotImplementedError('Path strength query failed')
+    w = graph.witness('e', 'c')
+    if w[0] != 'e' or w[-1] != 'c' or min(test.get(a, b) for a, b in zip(w, w[1:])) != 28:
+        raise NotImplementedError('Path witness query failed')
+    if graph.margin('a', 'b') != 20 - 25 or graph.topK(2) != ['e', 'a']:
+        raise NotImplementedError('Margin or top k query failed')
+    candidates, p = graph.pathMatrix()
+    if [list(row) for row in p.tolist()] != [[expected[a]['abcde'.index(b)] for b in candidates] for a in candidates]:
+        raise NotImplementedError('Path matrix export failed')
+
+    # Batch ranking: polls and withdrawal scenarios match one Graph each
+    for kernel in ('python', 'numpy') if _numpy() is not None else ('python',):
+        for c, ladder in Graph.withdrawalLadders(test, kernel=kernel).items():
+            scenario = test.copy()
+            scenario.remove(c)
+            if ladder != Graph(scenario, False).ladder():
+                raise NotImplementedError('Withdrawal ladders failed')
+        if Graph.ladders([test, Ballot('xyz'), test * 2 ** 70], kernel) != [graph.ladder(), ('x', 'y', 'z')] + \
+                [graph.ladder()] or Graph.subsetLadders(test, ['ab', 'cde'], kernel) != [('b', 'a'), ('e', 'd', 'c')]:
+            raise NotImplementedError('Batch ladders failed')
+    del test, graph, expected, w, candidates, p, scenario
+
+    # Weighted ballots: reweighting and retraction match a fresh tally
+    W = WeightedBallots('abcd')
+    W.cast('v1', 'abcd', 3)
+    W.cast('v2', ['b', ['c', 'a']], Fraction(1, 3))
+    W.cast('v3', 'dc', 2 ** 80)
+    W.cast('v4', 'cbad')
+    W.reweight('v1', Fraction(5, 2))
+    W.retract('v4')
+    W.cast('v3', 'dca', 2 ** 80)
+    expected = Ballot._blank('abcd')
+    expected.addRanking('abcd', Fraction(5, 2))
+    expected.addRanking(['b', ['c', 'a']], Fraction(1, 3))
+    expected.addRanking('dca', 2 ** 80)
+    if W.tally() != expected or len(W) != 3 or W.weight('v1') != Fraction(5, 2):
+        raise NotImplementedError('Weighted ballots failed')
+    if W.tally().fingerprint() != expected.fingerprint() or RankingCache().ladder(W.tally()) != Graph(expected, False).ladder():
+        raise NotImplementedError('Fingerprint of weighted ballots failed')
+    del W, expected
+
+    # Ranking cache keyed by tally fingerprint, in memory and on disk
+    import tempfile
+    T = Ballot('abcd') + Ballot('bcad') + Ballot('cabd') + Ballot('abcd') + Ballot('dabc')
+    cacheDir = tempfile.mkdtemp()
+    cache = RankingCache(size=1, directory=cacheDir)
+    r = cache.ladder(T)
+    if r != Graph(T, False).ladder() or cache.ladder(T.copy()) is not r:
+        raise NotImplementedError('RankingCache failed')
+    if cache.ladder(Ballot('xy')) != ('x', 'y') or T.fingerprint() == (T + Ballot('abcd')).fingerprint():
+        raise NotImplementedError('RankingCache failed')
+    if RankingCache(directory=cacheDir).get(T.fingerprint()) != r:
+        raise NotImplementedError('RankingCache disk tier failed')
+    for f in os.listdir(cacheDir):
+        os.remove(os.path.join(cacheDir, f))
+    os.rmdir(cacheDir)
+    del T, cache, cacheDir, r
+
+    # batched rankings, as used by the CSV and BLT importers
+    T = Ballot._blank(['a', 'b', 'c', 'd'])
+    T._addBatch([([[0], [2, 3]], 2), ([[1]], 3), ([[3], [0], [1], [2]], 2 ** 70)])
+    E = Ballot._blank(['a', 'b', 'c', 'd'])
+    E.addRanking(['a', ['c', 'd']], 2)
+    E.addRanking(['b'], 3)
+    E.addRanking(['d', 'a', 'b', 'c'], 2 ** 70)
+    if T != E:
+        raise NotImplementedError('Batched rankings failed')
+    del T, E
+
+    # Bootstrap: a clear winner always wins, a near tie splits, and seeds repeat
+    if _numpy() is not None:
+        boot = Bootstrap({'abc': 600, 'bca': 300, 'cab': 100})
+        if boot.ladder != ('a', 'b', 'c') or boot.run(200, seed=1, noise=0.5)['a'] != (1.0, 0.0, 0.0):
+            raise NotImplementedError('Bootstrap failed')
+        boot = Bootstrap({'ab': 50, 'ba': 49})
+        p = boot.run(400, seed=2, workers=2)
+        if not 0.2 < p['a'][0] < 0.8 or abs(sum(p['a']) - 1) > 1e-9 or p != boot.run(400, seed=2, workers=2):
+            raise NotImplementedError('Bootstrap resampling failed')
+        del boot, p
+
+    # Theoretical United States presidential election, 2000
+    print('\n== United States presidential election, 2000 ==')
+    republican = ['Bush', 'Buchanan', 'Browne', 'Gore', 'Nader']
+    democrat = ['Gore', 'Nader', 'Browne', 'Bush', 'Buchanan']
+    green = ['Nader', 'Browne', 'Gore', 'Bush', 'Buchanan']
+    reform = ['Buchanan', 'Bush', 'Gore', 'Browne', 'Nader']
+    libertarian = ['Browne', 'Nader', 'Gore', 'Bush', 'Buchanan']
+
+    repBallot = Ballot(republican) * 50456002
+    demBallot = Ballot(democrat) * 50999897
+    greenBallot = Ballot(green) * 2882955
+    reformBallot = Ballot(reform) * 448895
+    libBallot = Ballot(libertarian) * 384431
+
+    total = repBallot + demBallot + greenBallot + reformBallot + libBallot
+    total.printReport()
+
+    g = Graph(total)
+    g.print_ladder()
+
+
+if __name__ == '__main__':
+    main()
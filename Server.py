@@ -0,0 +1,224 @@
+import Console
+import Schulze
+import asyncio
+import json
+import os
+import sys
+from array import array
+from collections import Counter
+
+OK = b'{"ok": true}\n'
+
+
+class BallotServer(object):
+    """Accept ballots for one poll over a JSON lines protocol on a local socket.
+
+Every request is one line holding a JSON object and gets one JSON line back, in request order:
+    {"vote": ["a", ["b", "c"], "d"]}  ->  {"ok": true}, once the ballot is on disk
+    {"ladder": true}                  ->  {"ok": true, "ladder": [...]}, over every ballot on disk
+Invalid requests get {"ok": false, "error": "..."}. Clients may pipeline any number of requests.
+
+Accepted ballots are appended to the poll's binary ballot log in groups, one write and one fsync per
+group, and only then added to the in-memory tally and acknowledged. Identical rankings in a group are
+added to the tally once. The ladder is cached until a group adds new votes.
+"""
+
+    def __init__(self, poll_name, vote_dir='.\\votes', flush_interval=0.005, batch_size=4096, sparse=False,
+                 cache=None):
+        """
+    :param poll_name: poll ID
+    :param vote_dir: directory holding the poll
+    :param flush_interval: seconds to let a group of ballots grow before it is written
+    :param batch_size: write a group straight away once it holds this many ballots
+    :param sparse: keep the tally in a Schulze.SparseBallot
+    :param cache: Schulze.RankingCache shared with other servers or restarts, so unchanged tallies are not ranked again
+    """
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.cache = cache
+        choices = Console.load_poll(poll_name, vote_dir)
+        log_file = os.path.join(vote_dir, Console.ballot_log(poll_name))
+        if not os.path.exists(log_file):
+            Console.create_ballot_log(poll_name, vote_dir)
+        candidates, self._typecode, offset, self._markers = Console.read_log_header(log_file)
+        if [c.casefold() for c in candidates] != [c.casefold() for c in choices]:
+            raise ValueError('{} does not match the choices of poll {}'.format(log_file, poll_name))
+        self._registry = Console.CandidateRegistry(candidates)
+        self._tally = Console.tally_votes(poll_name, vote_dir, incremental=True, sparse=sparse)
+        self._log = open(log_file, mode='ab', buffering=0)  # unbuffered, so a failed write leaves nothing pending
+        width = len(candidates) * array(self._typecode).itemsize
+        partial = (self._log.tell() - offset) % width if width else 0
+        if partial:
+            # drop a record left half written by an interrupted append
+            self._log.truncate(self._log.tell() - partial)
+        self._pending = None  # (record bytes, Counter of records, future) of the group being collected
+        self._pending_count = 0
+        self._flushing = None  # task writing groups to disk
+        self._ladder = None
+        self._server = None
+        self._clients = {}  # connection handler task -> (reader, writer)
+        self.ballots = 0  # ballots accepted since start
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Start listening. Return the port, which the OS picks when port is 0."""
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+        return
+
+    async def close(self):
+        """Stop listening, answer every request already received, write every accepted ballot and close the log"""
+        if self._server is not None:
+            self._server.close()
+        for reader, writer in self._clients.values():
+            writer.transport.pause_reading()
+            reader.feed_eof()
+        await asyncio.gather(*self._clients, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+        while self._flushing is not None:
+            await self._flushing
+        self._log.close()
+        return
+
+    def submit(self, ranking):
+        """
+Validate a ranking and queue it for the next group written to disk
+    :param ranking: candidates most preferred first, as for Console.append_ballot
+    :return: future resolved once the ballot is on disk and in the tally
+    """
+        record = Console.encode_ballot(ranking, self._registry, self._typecode, self._markers).tobytes()
+        if self._pending is None:
+            self._pending = (bytearray(), Counter(), asyncio.get_running_loop().create_future())
+        data, counts, done = self._pending
+        data += record
+        counts[record] += 1
+        self._pending_count += 1
+        if self._flushing is None:
+            self._flushing = asyncio.ensure_future(self._flush_loop())
+        return done
+
+    def ladder(self):
+        """Return the ladder of every ballot on disk, computed at most once per group of new ballots"""
+        if self._ladder is None:
+            if self.cache is not None:
+                self._ladder = self.cache.ladder(self._tally)
+            else:
+                self._ladder = Schulze.Graph(self._tally, verbose=False).ladder()
+        return self._ladder
+
+    async def _flush_loop(self):
+        """Write pending groups one at a time. Ballots arriving during a write form the next group."""
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending is not None:
+                if self._pending_count < self.batch_size:
+                    await asyncio.sleep(self.flush_interval)
+                (data, counts, done), count = self._pending, self._pending_count
+                self._pending, self._pending_count = None, 0
+                try:
+                    await loop.run_in_executor(None, self._write, bytes(data))
+                except OSError as e:
+                    done.set_exception(e)
+                    continue
+                n = len(self._registry)
+                for record, weight in counts.items():
+                    Console._add_record(self._tally, array(self._typecode, record), self._typecode, n, weight)
+                self._ladder = None
+                self.ballots += count
+                done.set_result(None)
+        finally:
+            self._flushing = None
+        return
+
+    def _write(self, data):
+        """Append a group of records and sync it. On failure the log is cut back to where the group began."""
+        end = self._log.tell()
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[self._log.write(view):]
+            os.fsync(self._log.fileno())
+        except OSError:
+            # a partly written group would shift every record appended after it
+            self._log.truncate(end)
+            raise
+        return
+
+    def _request(self, line):
+        """Return the reply to one request line, or a future of a ballot that is replied to once written"""
+        try:
+            request = json.loads(line)
+            if 'vote' in request:
+                return self.submit(request['vote'])
+            if 'ladder' in request:
+                return json.dumps({'ok': True, 'ladder': self.ladder()}).encode('utf-8') + b'\n'
+            raise ValueError('Unknown request')
+        except (ValueError, TypeError, AttributeError) as e:
+            return json.dumps({'ok': False, 'error': str(e)}).encode('utf-8') + b'\n'
+
+    async def _handle(self, reader, writer):
+        replies = asyncio.Queue(maxsize=65536)
+        sender = asyncio.ensure_future(self._reply(replies, writer))
+        self._clients[asyncio.current_task()] = (reader, writer)
+        try:
+            async for line in reader:
+                if line.strip():
+                    await replies.put(self._request(line))
+            await replies.put(None)
+            await sender
+        except ConnectionError:
+            pass
+        finally:
+            del self._clients[asyncio.current_task()]
+            sender.cancel()
+            writer.close()
+        return
+
+    @staticmethod
+    async def _reply(replies, writer):
+        """Write replies in request order, waiting on each ballot's group to reach the disk"""
+        while True:
+            reply = await replies.get()
+            if reply is None:
+                break
+            if isinstance(reply, asyncio.Future):
+                try:
+                    await reply
+                    reply = OK
+                except OSError as e:
+                    reply = json.dumps({'ok': False, 'error': str(e)}).encode('utf-8') + b'\n'
+            writer.write(reply)
+            if replies.empty():
+                await writer.drain()
+        return
+
+
+def serve(poll_name, vote_dir='.\\votes', host='127.0.0.1', port=8642, **options):
+    """
+Run a BallotServer for a poll until interrupted
+    :param poll_name: poll ID
+    :param vote_dir: directory holding the poll
+    :param host: address to listen on
+    :param port: port to listen on
+    :param options: passed on to BallotServer
+    """
+    async def run():
+        server = BallotServer(poll_name, vote_dir, **options)
+        await server.start(host, port)
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return
+
+
+if __name__ == '__main__':
+    serve(*sys.argv[1:3])
@@ -0,0 +1,84 @@
+"""Self-tests of Server.py. Run with: python ServerTest.py"""
+import asyncio
+import errno
+import json
+import os
+import shutil
+import tempfile
+import Console
+import Server
+
+
+class _FullDisk(object):
+    """Ballot log that fails its next write halfway through, as on a full disk"""
+
+    def __init__(self, log):
+        self._log = log
+        self.failures = 1
+
+    def write(self, data):
+        if self.failures:
+            self.failures -= 1
+            self._log.write(data[:len(data) // 2 + 1])
+            raise OSError(errno.ENOSPC, 'No space left on device')
+        return self._log.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._log, name)
+
+
+async def _session(server, requests, pipelined=True):
+    """Send every request on one connection and return the decoded replies"""
+    port = await server.start()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    if pipelined:
+        writer.write(b''.join(json.dumps(r).encode('utf-8') + b'\n' for r in requests))
+        await writer.drain()
+        replies = [json.loads(await reader.readline()) for r in requests]
+    else:
+        replies = []
+        for r in requests:
+            writer.write(json.dumps(r).encode('utf-8') + b'\n')
+            replies.append(json.loads(await reader.readline()))
+    writer.close()
+    await server.close()
+    return replies
+
+
+def main():
+    vote_dir = tempfile.mkdtemp(prefix='schulze-server-')
+    try:
+        with open(os.path.join(vote_dir, Console.poll_file('p')), mode='w') as fout:
+            fout.write('Alice\nBob\nCarol\n')
+        Console.append_ballot('p', ['carol'], vote_dir)
+
+        # votes, invalid requests and the ladder over one pipelined connection
+        votes = [['Alice', 'Bob', 'Carol'], ['bob', ['alice', 'carol']], ['Alice', 'Carol'], ['alice']]
+        requests = [{'vote': v} for v in votes[:2]] + [{'vote': ['Dave']}, {'vote': ['bob', 'bob']}, {'foo': 1}] + \
+                   [{'vote': v} for v in votes[2:]]
+        server = Server.BallotServer('p', vote_dir, flush_interval=0)
+        replies = asyncio.run(_session(server, requests))
+        if [r['ok'] for r in replies] != [True, True, False, False, False, True, True] or server.ballots != 4:
+            raise NotImplementedError('Server replies failed')
+        total = Console.tally_votes('p', vote_dir)
+        ladder = json.loads(json.dumps(Server.Schulze.Graph(total, False).ladder()))
+        replies = asyncio.run(_session(Server.BallotServer('p', vote_dir), [{'ladder': True}]))
+        if server._tally != total or replies[0]['ladder'] != ladder:
+            raise NotImplementedError('Server tally does not match the ballot log')
+
+        # a group that fails to write is refused and leaves no partial record behind
+        server = Server.BallotServer('p', vote_dir, flush_interval=0)
+        server._log = _FullDisk(server._log)
+        replies = asyncio.run(_session(server, [{'vote': ['bob']}, {'vote': ['carol', 'bob']}], pipelined=False))
+        if [r['ok'] for r in replies] != [False, True] or 'No space' not in replies[0]['error']:
+            raise NotImplementedError('Server write failure handling failed')
+        total.addRanking(['carol', 'bob'])
+        if Console.tally_votes('p', vote_dir) != total or server._tally != total:
+            raise NotImplementedError('Failed write corrupted the ballot log')
+        del votes, requests, server, replies, total, ladder
+    finally:
+        shutil.rmtree(vote_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()